@@ -22,96 +22,141 @@
 
 import logging
 import random
+import time
 
 from operator import itemgetter
 
-import utils
 import action
 import state as s
 
+from forecast import BattleMatrix
 from unit import Team
 
 
+class World(object):
+    """
+    What the AI looks at to make its decisions: the loaded map or a snapshot of it (see planner.Snapshot).
+    """
+
+    def __init__(self, grid, path, influence, units, enemies):
+        """
+        :param grid: the :class:`map.grid.TerrainGrid` units stand on
+        :param path: a :class:`map.pathfinder.Pathfinder` of grid
+        :param influence: a :class:`map.influence.InfluenceMap` of grid
+        :param units: the units of the team thinking
+        :param enemies: the units of its enemies
+        """
+        self.grid = grid
+        self.path = path
+        self.influence = influence
+        self.battles = BattleMatrix(units, enemies)
+
+    @classmethod
+    def live(cls, team) -> 'World':
+        _map = s.loaded_map
+        return cls(_map.grid, _map.path, _map.influence, team.units, s.units_manager.get_enemies(team))
+
+    def nearby_enemies(self, unit):
+        """
+        Returns the enemies unit can attack without moving.
+        """
+        min_range, max_range = unit.get_weapon_range()
+        return self.grid.enemies_at(unit, self.grid.ring(unit.coord, max_range, min_range))
+
+
 class AI(Team):
+    # tiles the pathfinder may settle per turn (see Pathfinder.expanded); past it units stop looking for enemies to
+    # walk to. A count of work rather than of time, so that a seeded match plays the same on any machine
+    budget = 5000
+
     def __init__(self, name, color, relation, units, boss, music):
         super().__init__(name, color, relation, units, boss, music)
         self.logger = logging.getLogger('AI')
 
     def __iter__(self):
-        _map = s.loaded_map
-        _path = _map.path
         random.shuffle(self.units)
-        for unit in self.units:
+        s.loaded_map.influence.invalidate()  # stats may have changed since last turn
+        thinking = 0.0  # seconds, not counting the time spent by the caller between actions
+        start = time.perf_counter()
+        world = World.live(self)
+        expanded = world.path.expanded
+        for unit in list(self.units):
             if s.winner is not None:
                 return
-            self.logger.info("Thinking what to do with %s...", unit.name)
-            attackable_enemies = _map.nearby_enemies(unit)
-            self.logger.info("Nearby attackable enemies: %s", attackable_enemies)
-            if len(attackable_enemies) > 0:
-                target = self.best_target(attackable_enemies)
-                self.logger.debug("%s attacks %s.", unit.name, target.name)
-                yield action.Attack(unit, target)
+            if unit not in self.units:  # killed by a counterattack earlier this turn
+                continue
+            actions = self.decide(world, unit, world.path.expanded - expanded > self.budget)
+            thinking += time.perf_counter() - start
+            yield from actions
+            start = time.perf_counter()
+            if actions and isinstance(actions[-1], action.Attack):
+                world.battles.update(unit, actions[-1].defending)
             else:
-                enemies = self.enemies_in_walkable_area(unit)
-                self.logger.debug("Units next to %s: %s", unit.name, enemies)
-                if len(enemies) > 0:
-                    target = self.best_target(enemies)
-                    path = _path.shortest_path(unit.coord, target.coord, unit.movement)
-                    if path:
-                        dest = path[-1]
-                        self.logger.debug("%s will reach %s from %s.", unit.name, target.name, dest)
-                        yield action.Move(unit, dest)
-                        yield action.Attack(unit, target)
-                    else:
-                        self.logger.debug("%s can't reach %s. Wait.", unit.name, target.name)
-                        unit.played = True
-                else:
-                    target = self.nearest_enemy(unit)
-                    path = _path.shortest_path(unit.coord, target.coord, unit.movement)
-                    self.logger.debug("Unit %s can't reach any enemy. Target is %s, path is %s." % (unit.name, target.name, path))
-                    if path:
-                        dest = path[-1]
-                        yield action.Move(unit, dest)
-                    unit.played = True
-
-    def nearest_enemy(self, unit):
+                unit.played = True
+        thinking += time.perf_counter() - start
+        self.logger.info("Turn planned in %.1f ms", thinking * 1000)
+
+    def decide(self, world, unit, hurried=False):
+        """
+        Decides what unit does this turn.
+        :param world: the :class:`World` to look at
+        :param hurried: out of budget: don't look for enemies to walk to
+        :return: the list of actions of unit, empty if it waits
         """
-        Finds the nearest enemy.
+        self.logger.info("Thinking what to do with %s...", unit.name)
+        attackable_enemies = world.nearby_enemies(unit)
+        self.logger.info("Nearby attackable enemies: %s", attackable_enemies)
+        if len(attackable_enemies) > 0:
+            target = self.best_target(world.battles, unit, attackable_enemies)
+            self.logger.debug("%s attacks %s.", unit.name, target.name)
+            return [action.Attack(unit, target)]
+        if not hurried:
+            enemies = self.enemies_in_walkable_area(unit, world)
+        else:
+            self.logger.debug("Out of budget: %s won't look for enemies to reach.", unit.name)
+            enemies = []
+        self.logger.debug("Units next to %s: %s", unit.name, enemies)
+        if len(enemies) > 0:
+            target = self.best_target(world.battles, unit, enemies, unit.get_weapon_range()[0])
+            path = world.path.shortest_path(unit.coord, target.coord, unit.movement)
+            if path:
+                dest = path[-1]
+                self.logger.debug("%s will reach %s from %s.", unit.name, target.name, dest)
+                return [action.Move(unit, dest), action.Attack(unit, target)]
+            self.logger.debug("%s can't reach %s. Wait.", unit.name, target.name)
+            return []
+        path = world.path.toward_nearest_enemy(unit, unit.movement)
+        if self.logger.isEnabledFor(logging.DEBUG):  # finding the target again costs as much as the path
+            target = self.nearest_enemy(unit, world)
+            self.logger.debug("Unit %s can't reach any enemy. Target is %s, path is %s.",
+                              unit.name, target.name if target else None, path)
+        if path:
+            return [action.Move(unit, path[-1])]
+        return []
+
+    def nearest_enemy(self, unit, world=None):
+        """
+        Finds the nearest enemy, that is the one unit can reach with the least moves.
         """
-        _path = s.loaded_map.path
-        enemy_units = s.units_manager.get_enemies(self)
-        random.shuffle(enemy_units)
-        l = [(len(_path.shortest_path(unit.coord, enemy.coord)), enemy) for enemy in enemy_units]
-        l.sort(key=itemgetter(0))
-        nearest_enemy = l[0][1]
-        return nearest_enemy
-
-    def enemies_in_walkable_area(self, unit):
+        _path = world.path if world else s.loaded_map.path
+        return _path.nearest_enemy(unit)
+
+    def enemies_in_walkable_area(self, unit, world=None):
         """
         Return the enemies in his area
         """
-        _path = s.loaded_map.path
-        move_area = _path.area(unit.coord, unit.movement, False)
-        min_range, max_range = unit.get_weapon_range()
-        enemies = set()
-        for (x, y) in move_area:
-            for i in range(x - max_range, x + max_range + 1):
-                for j in range(y - max_range, y + max_range + 1):
-                    if min_range <= utils.distance((x, y), (i, j)) <= max_range:
-                        try:
-                            enemy = s.loaded_map.get_unit((i, j))
-                            if enemy and s.units_manager.are_enemies(enemy, unit):
-                                enemies.add(enemy)
-                        except KeyError:
-                            pass
-        return enemies
-
-    def best_target(self, enemies):
+        influence = world.influence if world else s.loaded_map.influence
+        return influence.enemies_in_reach(unit)
+
+    def best_target(self, battles, unit, enemies, distance=None):
         """
-        Choose the best enemy to attack from a list
+        Choose the best enemy to attack from a list: the one against which the expected damage dealt minus the
+        expected damage taken is the highest, or the one with the lowest value among equally good battles.
+        :param battles: BattleMatrix of this team against its enemies
+        :param distance: distance unit will attack from (defaults to the current distance from each enemy)
         """
-        enemies_values = [ u.value() for u in enemies ]
-        ranking = list(zip(enemies_values, enemies))
-        ranking.sort(key=itemgetter(0))
-        best = ranking[0][1]
+        dealt, taken = battles.expected_damage(unit, enemies, distance)
+        ranking = list(zip(taken - dealt, [enemy.value() for enemy in enemies], enemies))
+        ranking.sort(key=itemgetter(0, 1))
+        best = ranking[0][2]
         return best
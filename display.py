@@ -12,7 +12,7 @@ import fonts
 
 import math
 
-from typing import Tuple
+from typing import List, Tuple
 
 
 window = None
@@ -24,6 +24,7 @@ mode = pygame.RESIZABLE
 spinner_angle = 0
 spinner_size = (15, 15)
 FPS_FONT = None
+show_redraws = False  # outline the areas updated every frame
 
 pygame.mixer.pre_init(frequency=44100, size=-16, channels=2)
 
@@ -89,10 +90,11 @@ def set_resolution(res: Tuple[int, int]):
     pygame.event.post(pygame.event.Event(pygame.VIDEORESIZE, size=res, w=res[0], h=res[1]))
 
 
-def draw_fps(font=None) -> None:
+def draw_fps(font=None) -> List[pygame.Rect]:
     """
     Draws an FPS counter and a spinner.
     :param font: the font to use to render the counter. There is a default font if not specified.
+    :return: the areas of the window that were drawn on
     """
     global spinner_angle
     if not font:
@@ -107,7 +109,21 @@ def draw_fps(font=None) -> None:
     spinner_angle %= math.pi * 2
     surf = pygame.Surface(spinner_size)
     pygame.draw.arc(surf, c.WHITE, surf.get_rect(), spinner_angle, spinner_angle + math.pi / 4, 2)
-    window.blit(surf, surf.get_rect(top=5, right=screen_w - 5))
+    spinner_rect = window.blit(surf, surf.get_rect(top=5, right=screen_w - 5))
+    return [rec, spinner_rect]
+
+
+def draw_redraws(rects: List[pygame.Rect], pixels: int) -> List[pygame.Rect]:
+    """
+    Debug overlay: outlines the areas of the window updated this frame and prints how many pixels were pushed.
+    :param rects: the areas to outline
+    :param pixels: the pixels pushed to the screen this frame
+    :return: the areas of the window that were drawn on
+    """
+    drawn = [pygame.draw.rect(window, c.RED, rect, 1) for rect in rects]
+    label = FPS_FONT.render('%d px' % pixels, True, c.WHITE, c.BLACK).convert()
+    drawn.append(window.blit(label, label.get_rect(top=20, right=window.get_width() - 5)))
+    return drawn
 
 
 def tick(_fps=None) -> int:
@@ -127,6 +143,13 @@ def flip() -> None:
     pygame.display.flip()
 
 
+def update(rects: List[pygame.Rect]) -> None:
+    """
+    Equivalent to pygame.display.update(rects): pushes only those areas of the window to the screen.
+    """
+    pygame.display.update(rects)
+
+
 def get_rect(**kwargs) -> pygame.Rect:
     """
     Returns window's rect.
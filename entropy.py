@@ -0,0 +1,175 @@
+"""
+Random bits measured in advance on the quantum backend.
+
+A collapse only needs SHOTS random bits, one per shot of a Bell pair, so instead of sending a job for every
+entanglement QuantumEntropyPool measures wide circuits of Hadamard gates in the background and hands out their bits
+as needed. Unused bits are saved to disk and loaded back on the next launch.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import quantum
+
+
+class QuantumEntropyPool(object):
+    """
+    Compact buffer of measured bits, refilled in the background whenever fewer than low_water bits are left.
+
+    If the pool runs dry before a refill completes, bits are drawn from Python's random module instead and counted
+    in fallbacks.
+    """
+
+    def __init__(self, path: Optional[str] = None, capacity: int = 1 << 16, low_water: int = 1 << 12):
+        """
+        :param path: where unused bits are persisted between sessions, None to keep them in memory only
+        :param capacity: maximum number of bits kept in the pool
+        :param low_water: a refill starts when fewer bits than this are left
+        """
+        self.logger = logging.getLogger('QuantumEntropyPool')
+        self.path = path
+        self.capacity = capacity
+        self.low_water = low_water
+        self.lock = threading.Lock()
+        self.bits = bytearray()  # 8 bits per byte, most significant first
+        self.head = 0  # bits of self.bits already handed out
+        self.refilling: Optional[Future] = None
+
+        self.served = 0
+        self.fallbacks = 0
+        self.refills = 0
+        self.refill_time = 0.0  # seconds spent in all refills
+        self.last_refill_time = 0.0
+
+        if path is not None:
+            self.load()
+        if self.depth < self.low_water:
+            self.refill()
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of bits left in the pool.
+        """
+        return len(self.bits) * 8 - self.head
+
+    def take(self, n: int) -> List[int]:
+        """
+        Returns n random bits, triggering a refill if the pool gets low.
+        """
+        with self.lock:
+            if self.depth >= n:
+                head, bits = self.head, self.bits
+                out = [bits[i >> 3] >> (7 - (i & 7)) & 1 for i in range(head, head + n)]
+                self.head += n
+                del self.bits[:self.head >> 3]
+                self.head &= 7
+                self.served += n
+            else:
+                out = None
+                self.fallbacks += 1
+            low = self.depth < self.low_water
+        if low:
+            self.refill()
+        if out is None:
+            self.logger.debug("Pool dry: %d bits from the local source", n)
+            out = [random.getrandbits(1) for _ in range(n)]
+        return out
+
+    def bell_counts(self, shots: int) -> Dict[str, int]:
+        """
+        Returns counts shaped like those of a Bell pair measured shots times.
+        """
+        ones = sum(self.take(shots))
+        return {key: count for key, count in (('00', shots - ones), ('11', ones)) if count}
+
+    def refill(self) -> None:
+        """
+        Starts measuring new bits on the executor unless a refill is already running.
+        """
+        with self.lock:
+            if self.refilling is not None and not self.refilling.done():
+                return
+            self.refilling = quantum.get_executor().submit(self.__refill)
+
+    def __refill(self) -> None:
+        start = time.perf_counter()
+        backend = quantum.get_backend()
+        width = min(backend.max_qubits, 16)
+        missing = self.capacity - self.depth
+        shots = max(1, min(1024, -(-missing // width)))
+
+        circuit = quantum.Circuit(width)
+        for qubit in range(width):
+            circuit.h(qubit)
+        try:
+            counts = backend.run(circuit, shots)
+        except Exception:
+            self.logger.exception("Refill failed")
+            return
+
+        # backends only return histograms: shuffle the shots back into a sequence
+        outcomes = [bits for bits, count in counts.items() for _ in range(count)]
+        random.shuffle(outcomes)
+        stream = ''.join(outcomes)
+        stream = stream[:len(stream) - len(stream) % 8]
+        data = int(stream, 2).to_bytes(len(stream) // 8, 'big') if stream else b''
+
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            space = max(0, (self.capacity - self.depth) // 8)
+            self.bits.extend(data[:space])
+            self.refills += 1
+            self.refill_time += elapsed
+            self.last_refill_time = elapsed
+        self.logger.debug("Refilled %d bits in %.1f ms, depth %d", len(data) * 8, elapsed * 1000, self.depth)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'depth': self.depth,
+            'capacity': self.capacity,
+            'served': self.served,
+            'fallbacks': self.fallbacks,
+            'refills': self.refills,
+            'last_refill_ms': self.last_refill_time * 1000,
+            'mean_refill_ms': self.refill_time * 1000 / self.refills if self.refills else 0.0,
+        }
+
+    def load(self) -> None:
+        """
+        Loads the bits saved by the previous session. The file is removed so that no bit is ever used twice.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read(self.capacity // 8)
+            os.remove(self.path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            self.logger.warning("Couldn't load %s: %s", self.path, e)
+            return
+        with self.lock:
+            self.bits.extend(data)
+        self.logger.info("Loaded %d bits from %s", len(data) * 8, self.path)
+
+    def save(self) -> None:
+        """
+        Saves the unused bits to self.path.
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            data = bytes(self.bits[(self.head + 7) >> 3:])
+        try:
+            with open(self.path, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            self.logger.warning("Couldn't save %s: %s", self.path, e)
+            return
+        self.logger.info("Saved %d bits to %s (%s)", len(data) * 8, self.path, self.stats())
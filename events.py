@@ -17,6 +17,19 @@ available_events = set(range(p.USEREVENT, p.NUMEVENTS))
 __logger = logging.getLogger('EventHandler')
 
 
+def new_event_type() -> int:
+    """
+    Reserves a user event type, e.g. to signal something from another thread with pygame.event.post.
+    """
+    event_type = available_events.pop()
+    __logger.debug("New event type %d", event_type)
+    return event_type
+
+
+def free_event_type(event_type: int) -> None:
+    available_events.add(event_type)
+
+
 def new_timer(time: int):
     event_type = available_events.pop()
     pygame.time.set_timer(event_type, time)
@@ -0,0 +1,251 @@
+"""
+Exact outcome distribution of a battle, computed before committing to it.
+
+A battle is at most three attacks long (see rooms.BattleAnimation) and each attack has at most three outcomes (miss,
+hit, critical), so instead of sampling, forecast enumerates every branch of the outcome tree with its probability.
+
+BattleMatrix trades exactness for scale: it evaluates every attacker against every defender at once with NumPy, to
+rank many candidate battles by their expected damage.
+"""
+
+import math
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def chance(percent: float) -> float:
+    """
+    Probability that random.randrange(0, 100) < percent, which is how Unit.attack rolls hits and criticals.
+    """
+    return min(100, max(0, math.ceil(percent))) / 100
+
+
+def round_order(attacks: int, counters: int) -> List[bool]:
+    """
+    Returns who strikes in each round of a battle: True for the attacking unit, False for the defending one. Follows
+    BattleAnimation.next_round, e.g. 2 attacks and 1 counterattack give [True, False, True].
+    """
+    order = []
+    first = True
+    at, dt = attacks, counters
+    while True:
+        order.append(first)
+        at -= 1
+        if dt > 0:
+            at, dt = dt, at
+            first = not first
+        if at <= 0 and dt <= 0:
+            return order
+
+
+class Strike(object):
+    """
+    The possible outcomes of a unit's attack against an enemy, armed and with bare hands.
+    """
+    __slots__ = ('armed', 'bare')
+
+    def __init__(self, unit, enemy):
+        weapon = unit.weapon
+        self.armed = self.outcomes(*unit.attack_stats(enemy, weapon)) if weapon is not None else None
+        self.bare = self.outcomes(*unit.attack_stats(enemy))
+
+    @staticmethod
+    def outcomes(hit: float, dmg: int, critical: int) -> List[Tuple[float, int]]:
+        """
+        Returns (probability, damage) for the outcomes that change something: criticals and hits, which also wear
+        the weapon out.
+        """
+        if dmg <= 0:
+            return []  # misses and null attacks leave everything as it is
+        p_hit, p_critical = chance(hit), chance(critical)
+        return [(p_hit * p_critical, dmg * 3), (p_hit * (1 - p_critical), dmg)]
+
+
+class Forecast(object):
+    """
+    Outcome distribution of a battle between attacking and defending.
+
+    attacking_hp and defending_hp map the remaining health points of each unit to their probability.
+    """
+
+    def __init__(self, attacking, defending, attacks: int, counters: int, states: Dict[Tuple[int, int, int, int], float]):
+        self.attacking = attacking
+        self.defending = defending
+        self.attacks = attacks
+        self.counters = counters
+        self.attacking_hp: Dict[int, float] = {}
+        self.defending_hp: Dict[int, float] = {}
+        for (hp_a, hp_d, _, _), p in states.items():
+            self.attacking_hp[hp_a] = self.attacking_hp.get(hp_a, 0.0) + p
+            self.defending_hp[hp_d] = self.defending_hp.get(hp_d, 0.0) + p
+
+    @property
+    def kill_chance(self) -> float:
+        """
+        Probability that the defending unit dies.
+        """
+        return self.defending_hp.get(0, 0.0)
+
+    @property
+    def death_chance(self) -> float:
+        """
+        Probability that the attacking unit dies.
+        """
+        return self.attacking_hp.get(0, 0.0)
+
+    @property
+    def damage_dealt(self) -> float:
+        """
+        Expected health points taken from the defending unit.
+        """
+        return self.defending.health - sum(hp * p for hp, p in self.defending_hp.items())
+
+    @property
+    def damage_taken(self) -> float:
+        """
+        Expected health points taken from the attacking unit.
+        """
+        return self.attacking.health - sum(hp * p for hp, p in self.attacking_hp.items())
+
+    def __str__(self):
+        return _("Kill %d%%  Death %d%%") % (round(self.kill_chance * 100), round(self.death_chance * 100))
+
+
+def forecast(attacking, defending, distance: Optional[int] = None) -> Forecast:
+    """
+    Computes the exact outcome distribution of a battle where attacking attacks defending, from distance if given or from where
+    they stand.
+    """
+    attacks, counters = attacking.number_of_attacks(defending, distance)
+    strikes = {True: Strike(attacking, defending), False: Strike(defending, attacking)}
+
+    def uses(unit):
+        return unit.weapon.uses if unit.weapon is not None else 0
+
+    # (attacking hp, defending hp, attacking weapon uses, defending weapon uses) -> probability
+    states = {(attacking.health, defending.health, uses(attacking), uses(defending)): 1.0}
+    for first in round_order(attacks, counters):
+        strike = strikes[first]
+        following = {}
+        for state, p in states.items():
+            hp_a, hp_d, uses_a, uses_d = state
+            if hp_a <= 0 or hp_d <= 0:
+                following[state] = following.get(state, 0.0) + p  # the battle is over in this branch
+                continue
+            weapon_uses = uses_a if first else uses_d
+            outcomes = strike.armed if weapon_uses > 0 else strike.bare
+            left = p
+            for q, dmg in outcomes:
+                left -= p * q
+                if first:
+                    branch = (hp_a, max(0, hp_d - dmg), max(0, uses_a - 1), uses_d)
+                else:
+                    branch = (max(0, hp_a - dmg), hp_d, uses_a, max(0, uses_d - 1))
+                following[branch] = following.get(branch, 0.0) + p * q
+            following[state] = following.get(state, 0.0) + left
+        states = following
+
+    return Forecast(attacking, defending, attacks, counters, states)
+
+
+# columns of the stats arrays of BattleMatrix
+FIELDS = HEALTH, STRENGTH, SKILL, SPEED, LUCK, DEFENCE, HIT, MIGHT, CRIT, MIN_RANGE, MAX_RANGE = range(11)
+
+
+class BattleMatrix(object):
+    """
+    Hit chance, critical chance, damage and speed advantage of every attacker against every defender, as
+    attackers x defenders arrays built from the stats of both sides in one pass. Counterattacks are stored in the
+    same orientation, e.g. counter_dmg[i, j] is the damage defenders[j] inflicts to attackers[i].
+
+    Call update with the units whose stats changed (health, weapon uses, level) to keep the matrix current.
+    """
+    def __init__(self, attackers: Iterable, defenders: Iterable):
+        self.attackers = list(attackers)
+        self.defenders = list(defenders)
+        self.rows = {unit: i for i, unit in enumerate(self.attackers)}
+        self.columns = {unit: j for j, unit in enumerate(self.defenders)}
+        self.a = np.array([self.stats(unit) for unit in self.attackers], dtype=float).reshape(-1, len(FIELDS))
+        self.d = np.array([self.stats(unit) for unit in self.defenders], dtype=float).reshape(-1, len(FIELDS))
+        self.compute()
+
+    @staticmethod
+    def stats(unit) -> Tuple[float, ...]:
+        weapon = unit.weapon
+        armed = weapon is not None and weapon.uses > 0
+        min_range, max_range = unit.get_weapon_range()
+        hit, might, crit = (weapon.hit, weapon.might, weapon.crit) if armed else (0, 0, 0)
+        return (unit.health, unit.strength, unit.skill, unit.speed, unit.luck, unit.defence, hit, might, crit,
+                min_range, max_range)
+
+    @staticmethod
+    def strikes(attacking: np.ndarray, defending: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns hit chance, critical chance and damage of attacking[i] against defending[j], as in Unit.attack_stats.
+        """
+        a, d = attacking.T[:, :, np.newaxis], defending.T[:, np.newaxis, :]
+        dmg = a[STRENGTH] + a[MIGHT] - d[DEFENCE]
+        hit = np.broadcast_to(a[SKILL] * 2 + a[HIT] + a[LUCK] / 2, dmg.shape)  # the defender doesn't matter
+        crit = a[SKILL] // 2 + a[CRIT] - d[LUCK]
+        return np.clip(np.ceil(hit), 0, 100) / 100, np.clip(np.ceil(crit), 0, 100) / 100, dmg
+
+    def compute(self) -> None:
+        shape = len(self.attackers), len(self.defenders)
+        for name in ('hit', 'crit', 'dmg', 'counter_hit', 'counter_crit', 'counter_dmg', 'attacks', 'counters',
+                     'strike', 'counter_strike'):
+            setattr(self, name, np.zeros(shape))
+        self.fill(slice(None), slice(None))
+
+    def fill(self, rows, columns) -> None:
+        """
+        Computes the block of the matrices between attackers[rows] and defenders[columns].
+        """
+        block = rows, columns
+        a, d = self.a[rows], self.d[columns]
+        hit, crit, dmg = self.strikes(a, d)
+        counter_hit, counter_crit, counter_dmg = (m.T for m in self.strikes(d, a))
+        speed_a, speed_d = a[:, SPEED, np.newaxis], d[np.newaxis, :, SPEED]
+        self.hit[block], self.crit[block], self.dmg[block] = hit, crit, dmg
+        self.counter_hit[block], self.counter_crit[block], self.counter_dmg[block] = \
+            counter_hit, counter_crit, counter_dmg
+        self.attacks[block] = 1 + (speed_a > speed_d)
+        self.counters[block] = 1 + (speed_d > speed_a)
+        # expected damage of a single strike: criticals triple the damage, null attacks do nothing
+        self.strike[block] = hit * (1 + 2 * crit) * np.maximum(dmg, 0)
+        self.counter_strike[block] = counter_hit * (1 + 2 * counter_crit) * np.maximum(counter_dmg, 0)
+
+    def update(self, *units) -> None:
+        """
+        Reads the stats of units again and recomputes their rows and columns.
+        """
+        for unit in units:
+            if unit in self.rows:
+                i = self.rows[unit]
+                self.a[i] = self.stats(unit)
+                self.fill(slice(i, i + 1), slice(None))
+            if unit in self.columns:
+                j = self.columns[unit]
+                self.d[j] = self.stats(unit)
+                self.fill(slice(None), slice(j, j + 1))
+
+    def expected_damage(self, attacker, defenders: Sequence, distance: Optional[int] = None) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the damage attacker is expected to deal to each of defenders and to take from them, capped by the
+        health of whoever receives it.
+        :param distance: distance the battles take place at (defaults to the current distance from each defender)
+        """
+        i = self.rows[attacker]
+        js = np.fromiter((self.columns[unit] for unit in defenders), dtype=int, count=len(defenders))
+        if distance is None:
+            x, y = attacker.coord
+            distance = np.fromiter((abs(x - u.coord[0]) + abs(y - u.coord[1]) for u in defenders), dtype=int,
+                                   count=len(defenders))
+        a, d = self.a[i], self.d[js]
+        in_range = (a[MIN_RANGE] <= distance) & (distance <= a[MAX_RANGE])
+        in_counter_range = (d[:, MIN_RANGE] <= distance) & (distance <= d[:, MAX_RANGE])
+        dealt = np.minimum(self.attacks[i, js] * in_range * self.strike[i, js], d[:, HEALTH])
+        taken = np.minimum(self.counters[i, js] * in_counter_range * self.counter_strike[i, js], a[HEALTH])
+        return dealt, taken
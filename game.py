@@ -28,6 +28,8 @@ import display
 import gui
 import utils
 import ai
+import action
+import planner
 import room
 import rooms
 import colors as c
@@ -139,16 +141,26 @@ class AITurn(Turn):
 
     def begin(self):
         super().begin()
-        self.actions = iter(self.team)
+        # the whole turn is planned in the background, the actions are executed as soon as they are ready
+        self.planner = planner.Planner(self.team)
+        self.planner.start()
+        self.battle = None
 
     def loop(self, _events, dt):
         super().loop(_events, dt)
         if len(s.loaded_map.children) == 0 and not self.next:
+            if self.battle is not None:
+                self.planner.resolved(self.battle)
+                self.battle = None
             try:
-                action = next(self.actions)
-                s.loaded_map.do_action(action)
+                _action = self.planner.next_action()
             except StopIteration:
                 self.team.end_turn()
+                return
+            if _action is not None:
+                if isinstance(_action, action.Attack):
+                    self.battle = _action
+                s.loaded_map.do_action(_action)
 
 
 def main_menu():
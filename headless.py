@@ -0,0 +1,183 @@
+"""
+Headless matches: a map played by the AI for every team with the same TileMap and UnitsManager state as the game, but
+no window, animations or sounds. Used by main.py --headless and by balance and regression scripts:
+
+    import headless
+    result = headless.play_match(resources.map_path('default.tmx'), seed=42)
+    print(result)
+"""
+
+import os
+
+# SDL reads these when pygame.display is initialized, so they must be set before display.initialize
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('LANG', 'en_US')
+
+import builtins
+import contextlib
+import gettext
+import random
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import display
+import game  # imports the modules of the game in an order free of circular imports
+import action
+import resources
+import state as s
+
+
+class MatchResult(object):
+    """
+    What happened in a headless match. turns counts the phases played, one per team per round.
+    """
+
+    def __init__(self, map_path, seed):
+        self.map_path = map_path
+        self.seed = seed
+        self.winner: Optional[str] = None
+        self.turns = 0
+        self.moves = 0
+        self.battles = 0
+        self.damage: Dict[str, int] = {}  # damage dealt by each team
+        self.collapses = 0  # entanglement collapses; the AI doesn't entangle yet
+        self.load_time = 0.0  # seconds spent loading the map
+        self.ai_time = 0.0  # seconds spent deciding the actions
+        self.battle_time = 0.0  # seconds spent resolving the battles
+        self.time = 0.0  # seconds for the whole match, loading included
+
+    def __str__(self):
+        return (f"{os.path.basename(str(self.map_path))} seed {self.seed}: "
+                f"{self.winner if self.winner else 'nobody'} wins after {self.turns} turns, "
+                f"{self.moves} moves, {self.battles} battles in {self.time * 1000:.0f} ms "
+                f"(load {self.load_time * 1000:.0f} ms, AI {self.ai_time * 1000:.0f} ms, "
+                f"battles {self.battle_time * 1000:.0f} ms)")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'map': os.path.basename(str(self.map_path)),
+            'seed': self.seed,
+            'winner': self.winner,
+            'turns': self.turns,
+            'moves': self.moves,
+            'battles': self.battles,
+            'collapses': self.collapses,
+            'damage': dict(self.damage),
+            'time': self.time,
+            'load_time': self.load_time,
+            'ai_time': self.ai_time,
+            'battle_time': self.battle_time,
+        }
+
+
+def initialize() -> None:
+    """
+    Initializes pygame on SDL's dummy drivers, unless the game already did it.
+    """
+    if not hasattr(builtins, '_'):
+        gettext.install('ice-emblem', resources.LOCALE_PATH)
+    display.initialize()
+
+
+def battle(attacking, defending) -> List[Tuple[Any, str, int]]:
+    """
+    Resolves a battle like rooms.BattleAnimation does, round after round, without animations. Returns the attacker,
+    outcome and damage of every round.
+    """
+    if attacking.health <= 0:
+        raise ValueError(f"{attacking} is dead!")
+    if defending.health <= 0:
+        raise ValueError(f"{defending} is dead!")
+    if attacking.played:
+        raise ValueError(f"{attacking} has already played!")
+
+    attacking.prepare_battle()
+    defending.prepare_battle()
+
+    at, dt = attacking.number_of_attacks(defending)
+    att, dfn = attacking, defending
+    rounds = []
+    done = False
+    while not done:
+        rounds.append((att,) + tuple(att.attack(dfn)))
+        # same turn order as BattleAnimation.next_round
+        at -= 1
+        if dt > 0:
+            at, dt = dt, at
+            att, dfn = dfn, att
+        done = (at <= 0 and dt <= 0) or attacking.health <= 0 or defending.health <= 0
+
+    attacking.played = True
+
+    for unit1, unit2 in ((attacking, defending), (defending, attacking)):
+        if unit1.health > 0:
+            unit1.gain_exp(unit2)
+        else:
+            s.loaded_map.kill_unit(unit1)
+
+    if defending.team.is_defeated():
+        s.winner = attacking.team
+    elif attacking.team.is_defeated():
+        s.winner = defending.team
+
+    return rounds
+
+
+def play_match(map_path, seed: Optional[int] = None, max_turns: int = 200, verbose: bool = False) -> MatchResult:
+    """
+    Plays a whole match on map_path with the AI controlling every team.
+    :param map_path: the .tmx file to play
+    :param seed: seed of the random module, to replay a match exactly
+    :param max_turns: the match ends without a winner after this many turns
+    :param verbose: keep the game's battle log on stdout
+    """
+    initialize()
+    result = MatchResult(map_path, seed)
+    random.seed(seed)
+    start = time.perf_counter()
+
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+
+        s.load_map(map_path, all_ai=True)
+        _map, units_manager = s.loaded_map, s.units_manager
+        result.damage = {team.name: 0 for team in units_manager.teams}
+        result.load_time = time.perf_counter() - start
+
+        while s.winner is None and result.turns < max_turns:
+            team = units_manager.active_team
+            result.turns += 1
+            actions = iter(team)
+            while True:
+                tick = time.perf_counter()
+                try:
+                    _action = next(actions)
+                except StopIteration:
+                    result.ai_time += time.perf_counter() - tick
+                    break
+                result.ai_time += time.perf_counter() - tick
+                if isinstance(_action, action.Move):
+                    _map.move_unit(_action.who, _action.where)
+                    result.moves += 1
+                elif isinstance(_action, action.Attack):
+                    tick = time.perf_counter()
+                    for attacker, outcome, damage in battle(_action.attacking, _action.defending):
+                        result.damage[attacker.team.name] = result.damage.get(attacker.team.name, 0) + damage
+                    result.battle_time += time.perf_counter() - tick
+                    result.battles += 1
+                else:
+                    raise NotImplementedError(f"Action {type(_action)} not implemented!")
+            units_manager.switch_turn()
+
+    result.winner = s.winner.name if s.winner is not None else None
+    result.time = time.perf_counter() - start
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    for arg in sys.argv[1:] or ['default.tmx']:
+        print(play_match(resources.map_path(arg), seed=0))
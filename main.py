@@ -21,12 +21,23 @@
 #  MA 02110-1301, USA.
 
 
+import sys
+
+if '--profile-startup' in sys.argv:
+    # installed before anything else is imported, so that the report covers every module
+    import profiling
+
+    profiler = profiling.StartupProfiler()
+    profiler.install()
+else:
+    profiler = None
+
 import pygame
 import argparse
+import contextlib
 import traceback
 import logging
 import os
-import sys
 import gettext
 
 import utils
@@ -57,6 +68,19 @@ parser.add_argument('-l', '--logging', action='store', help=_('Choose logging le
                     required=False)
 parser.add_argument('-d', '--debug', action='store_const', help=_('Debug mode'), const=0, dest='logging')
 parser.add_argument('-f', '--file', action='store', help=_('Log file'), default=None, required=False)
+parser.add_argument('--quantum-backend', action='store', help=_('Where to run the entanglement circuits'),
+                    choices=['local', 'azure'], default='local', required=False)
+parser.add_argument('--quantum-entropy-pool', action='store', nargs='?', const='entropy.pool', default=None,
+                    metavar='FILE', help=_('Measure random bits in advance and keep the unused ones in FILE'),
+                    required=False)
+parser.add_argument('--headless', action='store_true', help=_('Let the AI play every team without a window'),
+                    required=False)
+parser.add_argument('--seed', action='store', help=_('Random seed of a headless match'), default=None, type=int,
+                    required=False)
+parser.add_argument('--profile-startup', action='store_true', help=_('Print how long each module took to load'),
+                    required=False)
+parser.add_argument('--show-redraws', action='store_true', help=_('Outline the parts of the window updated every frame'),
+                    required=False)
 args = parser.parse_args()
 
 # log to screen
@@ -68,12 +92,54 @@ if pygame.version.vernum < (2, 0, 0):
     logging.warning(_('Ice Emblem is tested only with Pygame 2.0.0+.'))
 
 
+def step(name):
+    if profiler is not None:
+        return profiler.step(name)
+    return contextlib.nullcontext()
+
+
+def launch_headless():
+    # must be imported before display is initialized: it selects SDL's dummy drivers
+    import headless
+
+    map_file = resources.map_path(args.map if args.map is not None else 'default.tmx')
+    print(headless.play_match(map_file, seed=args.seed, verbose=args.logging < 20))
+
+
 def launch():
-    import display
+    if args.headless:
+        return launch_headless()
+
+    with step('display.initialize'):
+        import display
+
+        display.initialize()
+        display.show_redraws = args.show_redraws
 
-    display.initialize()
+    with step('import game'):
+        import game
 
-    import game
+    with step('preloader'):
+        # decodes images and sprites and compiles the maps while the splash screen and the menus are shown
+        import preloader
+
+        preloader.start()
+
+    with step('quantum backend'):
+        # qiskit and azure-quantum are only imported by the warm-up, on a background thread
+        import quantum
+
+        quantum.set_backend(args.quantum_backend)
+        warm_up = quantum.warm_up()
+        if profiler is not None:
+            warm_up.add_done_callback(lambda f: profiler.add_step('quantum warm-up (background)', f.result()))
+        if args.quantum_entropy_pool:
+            import atexit
+            import entropy
+
+            pool = entropy.QuantumEntropyPool(args.quantum_entropy_pool)
+            quantum.set_entropy_pool(pool)
+            atexit.register(pool.save)
 
     map_file = None
     if args.map is not None:
@@ -85,6 +151,10 @@ def launch():
     else:
         logging.debug(_('No map on command line: choose the map via the main menu'))
 
+    if profiler is not None:
+        profiler.uninstall()
+        print(profiler.report())
+
     game.play(map_file)
 
 
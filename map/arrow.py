@@ -31,6 +31,9 @@ class Arrow(pygame.sprite.Sprite):
         self.path = []
         self.source = None
         self.valid = False
+        self.drawn_path = []  # the path currently drawn on self.image
+        self.dirty = 0
+        self.dirty_rects = []  # the tiles where the arrow changed, see tmx.SpriteLayer.changed
 
         self.update()
 
@@ -76,6 +79,10 @@ class Arrow(pygame.sprite.Sprite):
         if self.zoom != self.tilemap.zoom:
             self.zoom_changed()
         if not self.valid:
+            for coord in set(self.drawn_path) | set(self.path):
+                self.dirty_rects.append(pygame.Rect(self.tilemap.pixel_at(*coord, False), self.tilemap.zoom_tile_size))
+            self.drawn_path = list(self.path)
+            self.dirty = 1
             self.image.fill((0, 0, 0, 0))
             for coord in self.path:
                 img = self.get_arrow_part(coord)
@@ -3,6 +3,7 @@
 """
 
 
+import numpy as np
 import pygame
 
 import tmx
@@ -21,40 +22,70 @@ class CellHighlightLayer(tmx.SpriteLayer):
     def __init__(self, tilemap: tmx.TileMap):
         super().__init__()
         self.tilemap = tilemap
+        self.surfaces = {}  # highlight -> translucent tile surface, at self.surfaces_zoom
+        self.surfaces_zoom = None
+        self.cells = {highlight: {} for highlight in c.highlight}  # highlight -> coord -> CellHighlight
+        self.masks = {}  # highlight -> the mask its cells were made from
         self.update()
 
     def cell_rect_at(self, coord):
         return pygame.Rect(self.tilemap.pixel_at(*coord, False), self.tilemap.zoom_tile_size)
 
-    def update(self, selected=None, move=None, attack=None, entangle=None, played=None):
-        if move is None:
-            move = []
-        if attack is None:
-            attack = []
-        if played is None:
-            played = []
-        if entangle is None:
-            entangle = []
-
-        self.empty()
-
-        highlight_surfaces = {}
-        for highlight, color in c.highlight.items():
-            highlight_surfaces[highlight] = pygame.Surface(self.tilemap.zoom_tile_size)
-            highlight_surfaces[highlight].fill(color[:3])
-            highlight_surfaces[highlight].set_alpha(color[3])
-
-        if selected is not None:
-            self.add(CellHighlight(highlight_surfaces['selected'], self.cell_rect_at(selected)))
+    def highlight_surfaces(self):
+        if self.surfaces_zoom != self.tilemap.zoom:
+            self.surfaces = {}
+            for highlight, color in c.highlight.items():
+                self.surfaces[highlight] = pygame.Surface(self.tilemap.zoom_tile_size)
+                self.surfaces[highlight].fill(color[:3])
+                self.surfaces[highlight].set_alpha(color[3])
+            self.surfaces_zoom = self.tilemap.zoom
+            self.empty()
+            self.cells = {highlight: {} for highlight in c.highlight}
+            self.masks = {}
+        return self.surfaces
+
+    def sprites(self):
+        # the highlights are drawn in the order of colors.highlight, however they were added
+        return [cell for cells in self.cells.values() for cell in cells.values()]
 
-        for coord in move:
-            self.add(CellHighlight(highlight_surfaces['move'], self.cell_rect_at(coord)))
-
-        for coord in attack:
-            self.add(CellHighlight(highlight_surfaces['attack'], self.cell_rect_at(coord)))
-
-        for coord in entangle:
-            self.add(CellHighlight(highlight_surfaces['entangle'], self.cell_rect_at(coord)))
-
-        for coord in played:
-            self.add(CellHighlight(highlight_surfaces['played'], self.cell_rect_at(coord)))
+    def update(self, selected=None, move=None, attack=None, entangle=None, played=None):
+        """
+        :param selected: the selected coord
+        :param move: (h, w) boolean mask of the tiles to highlight as the move area, see map.ranges
+        :param attack: mask of the attack area
+        :param entangle: mask of the entangle area
+        :param played: coords of the units that played
+        """
+        self.highlight_surfaces()
+
+        # only the tiles whose highlights changed get a new sprite or lose theirs, so only they are drawn again
+        for highlight, mask in (('move', move), ('attack', attack), ('entangle', entangle)):
+            old = self.masks.get(highlight)
+            if mask is None:
+                if old is None:
+                    continue
+                mask = np.zeros_like(old)
+            elif old is None or old.shape != mask.shape:
+                old = np.zeros_like(mask)
+            ys, xs = np.nonzero(mask ^ old)
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                if mask[y, x]:
+                    self.show(highlight, (x, y))
+                else:
+                    self.hide(highlight, (x, y))
+            self.masks[highlight] = mask.copy()
+
+        for highlight, coords in (('selected', [selected] if selected is not None else []),
+                                  ('played', played or [])):
+            coords, old = set(coords), set(self.cells[highlight])
+            for coord in coords - old:
+                self.show(highlight, coord)
+            for coord in old - coords:
+                self.hide(highlight, coord)
+
+    def show(self, highlight, coord):
+        cell = self.cells[highlight][coord] = CellHighlight(self.surfaces[highlight], self.cell_rect_at(coord))
+        self.add(cell)
+
+    def hide(self, highlight, coord):
+        self.remove(self.cells[highlight].pop(coord))
@@ -0,0 +1,229 @@
+"""
+Compact array representation of the terrain of a TileMap.
+
+Every per-tile quantity is stored in a flat array indexed by y * w + x so that the pathfinder and the area code can
+work on plain integers instead of coordinate tuples and per-tile objects.
+"""
+
+
+from array import array
+from typing import Dict, List, Tuple
+
+Coord = Tuple[int, int]
+
+INF = float('inf')
+
+_kernels: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+
+
+def kernel(min_range: int, max_range: int) -> List[Tuple[int, int]]:
+    """
+    Returns the (dx, dy) offsets whose Manhattan length is between min_range and max_range, column by column.
+    """
+    offsets = _kernels.get((min_range, max_range))
+    if offsets is None:
+        offsets = _kernels[(min_range, max_range)] = [
+            (dx, dy) for dx in range(-max_range, max_range + 1) for dy in range(-max_range, max_range + 1)
+            if min_range <= abs(dx) + abs(dy) <= max_range]
+    return offsets
+
+
+def passes(allowed, movement_class) -> bool:
+    """
+    Tells whether a unit that can move on movement_class terrains may go through a tile whose allowed property is
+    allowed. The first matching entry wins: 'any' lets everyone through, 'none' stops everyone.
+    """
+    for terrain in allowed:
+        if terrain == 'any':
+            return True
+        if terrain == 'none':
+            return False
+        if terrain in movement_class:
+            return True
+    return False
+
+
+class TerrainGrid(object):
+    """
+    Array backed terrain and occupancy layer built once when the map is loaded.
+
+    The static arrays are:
+
+        moves - how many moves are required to go through a tile (infinite where there is no terrain)
+        defense, avoid - terrain bonuses
+        passable - per movement class bitmask: bit k is set if units of the k-th movement class can go through
+
+    The occupancy arrays are kept up to date by TileMap.move_unit, TileMap.kill_unit and TileMap.move_unit_undo:
+
+        occupancy - 0 if the tile is free, otherwise the index of the occupant's team plus one
+        units - the Unit standing on each tile or None
+
+    Every change of occupancy bumps version and the version of the team of the unit involved, so that caches built
+    on top of the grid can tell whether they are stale (see stamp). It also bumps the version of every movement class
+    that can't go through the tile: a unit standing there lets its allies through (see blocked).
+    """
+
+    def __init__(self, w: int, h: int, terrains, teams):
+        self.w, self.h = w, h
+        self.n = n = w * h
+        self.coords: List[Coord] = [(x, y) for y in range(h) for x in range(w)]
+
+        self.moves = array('d', [INF]) * n
+        self.defense = array('h', [0]) * n
+        self.avoid = array('h', [0]) * n
+        self.passable = array('I', [0]) * n
+        self.allowed: List[Tuple[str, ...]] = [()] * n  # only read when a new movement class shows up
+        self.classes: Dict[Tuple[str, ...], int] = {}  # movement class -> passable bit
+        self.class_versions: Dict[int, int] = {}  # passable bit -> occupancy changes on tiles it can't go through
+
+        for i, coord in enumerate(self.coords):
+            terrain = terrains.get(coord)
+            if terrain is not None:
+                self.moves[i] = terrain.moves
+                self.defense[i] = terrain.defense
+                self.avoid[i] = terrain.avoid
+                self.allowed[i] = tuple(terrain.allowed)
+
+        # Neighbors in the same order as TileMap.neighbors: east, west, south, north
+        self.adjacency: List[Tuple[int, ...]] = []
+        for x, y in self.coords:
+            n = [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]
+            self.adjacency.append(tuple(j * w + i for i, j in n if 0 <= i < w and 0 <= j < h))
+
+        # Team relations never change during a match: hostile[i][j] tells whether team i is enemy of team j - 1
+        self.teams = list(teams)
+        self.team_index = {team: i + 1 for i, team in enumerate(self.teams)}
+        self.hostile: List[bytes] = [bytes(1 + len(self.teams))]
+        for team in self.teams:
+            self.hostile.append(bytes([0] + [team.is_enemy(other) for other in self.teams]))
+
+        self.occupancy = bytearray(self.n)
+        self.units: list = [None] * self.n
+        self.version = 0
+        self.versions = [0] * (1 + len(self.teams))
+        for team in self.teams:
+            for unit in team.units:
+                self.place(unit, unit.coord)
+
+    def snapshot(self, units: Dict) -> 'TerrainGrid':
+        """
+        Returns a copy of the grid whose occupancy can change independently of this one, for planning ahead. The
+        terrain arrays are shared.
+        :param units: maps every unit on this grid to the unit that stands for it in the copy
+        """
+        grid = object.__new__(TerrainGrid)
+        grid.__dict__.update(self.__dict__)
+        grid.passable = array('I', self.passable)  # movement_class may add bits
+        grid.classes = dict(self.classes)
+        grid.class_versions = dict(self.class_versions)
+        grid.occupancy = bytearray(self.occupancy)
+        grid.units = [units[unit] if unit is not None else None for unit in self.units]
+        grid.versions = list(self.versions)
+        return grid
+
+    def index(self, coord: Coord) -> int:
+        return coord[1] * self.w + coord[0]
+
+    def check_coord(self, coord: Coord) -> bool:
+        x, y = coord
+        return 0 <= x < self.w and 0 <= y < self.h
+
+    def movement_class(self, unit) -> int:
+        """
+        Returns the passable bit of the unit's movement class, computing it for the whole map the first time a
+        movement class is seen.
+        """
+        key = tuple(unit.ALLOWED_TERRAINS)
+        try:
+            return self.classes[key]
+        except KeyError:
+            bit = self.classes[key] = 1 << len(self.classes)
+            self.class_versions[bit] = 0
+            for i, allowed in enumerate(self.allowed):
+                if passes(allowed, key):
+                    self.passable[i] |= bit
+            return bit
+
+    def team_of(self, unit) -> int:
+        return self.team_index.get(unit.team, 0)
+
+    def blocked(self, for_unit=None) -> bytes:
+        """
+        Returns a byte per tile: 1 if for_unit can't go through it. Enemy units are obstacles regardless of the
+        terrain, allied units never are. Without a unit nothing is an obstacle.
+        """
+        if for_unit is None:
+            return bytes(self.n)
+        bit = self.movement_class(for_unit)
+        hostile = self.hostile[self.team_of(for_unit)]
+        return bytes(hostile[o] if o else not p & bit for o, p in zip(self.occupancy, self.passable))
+
+    def is_obstacle(self, coord: Coord, for_unit=None) -> bool:
+        if for_unit is None:
+            return False
+        i = self.index(coord)
+        o = self.occupancy[i]
+        if o:
+            return bool(self.hostile[self.team_of(for_unit)][o])
+        return not self.passable[i] & self.movement_class(for_unit)
+
+    def stamp(self, team=None, movement_class=0) -> int:
+        """
+        Returns a number that changes whenever blocked would change for a unit of the team with the given index and
+        of movement_class (a passable bit): a unit hostile to the team moves, appears or dies, or any unit leaves or
+        enters a tile movement_class can't go through. If team is None the number never changes.
+        """
+        if team is None:
+            return 0
+        hostile, versions = self.hostile[team], self.versions
+        return sum(versions[t] for t in range(1, len(versions)) if hostile[t]) + \
+            self.class_versions.get(movement_class, 0)
+
+    def __bump(self, team: int, i: int) -> None:
+        self.version += 1
+        self.versions[team] += 1
+        passable = self.passable[i]
+        for bit in self.class_versions:
+            if not passable & bit:
+                self.class_versions[bit] += 1
+
+    def get_unit(self, coord: Coord):
+        return self.units[self.index(coord)]
+
+    def place(self, unit, coord: Coord) -> None:
+        i = self.index(coord)
+        self.units[i] = unit
+        self.occupancy[i] = self.team_of(unit)
+        self.__bump(self.occupancy[i], i)
+
+    def remove(self, coord: Coord) -> None:
+        i = self.index(coord)
+        self.__bump(self.occupancy[i], i)
+        self.units[i] = None
+        self.occupancy[i] = 0
+
+    def move(self, unit, source: Coord, target: Coord) -> None:
+        self.remove(source)
+        self.place(unit, target)
+
+    def ring(self, center: Coord, max_range: int, min_range: int = 0) -> List[int]:
+        """
+        Returns the indexes of the tiles whose distance from center is between min_range and max_range, column by
+        column.
+        """
+        x, y = center
+        w, h = self.w, self.h
+        return [(y + dy) * w + x + dx for dx, dy in kernel(min_range, max_range)
+                if 0 <= x + dx < w and 0 <= y + dy < h]
+
+    def enemies_at(self, unit, indexes) -> list:
+        """
+        Returns the units standing on the given tile indexes that are enemies of unit.
+        """
+        hostile = self.hostile[self.team_of(unit)]
+        occupancy, units = self.occupancy, self.units
+        return [units[i] for i in indexes if hostile[occupancy[i]]]
+
+    def path_cost(self, path) -> float:
+        moves, w = self.moves, self.w
+        return sum(moves[y * w + x] for x, y in path)
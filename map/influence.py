@@ -0,0 +1,163 @@
+"""
+Influence maps: what every team can strike within its next move.
+
+For every unit the reach (the tiles it can move to) is dilated by the ring of its weapon range to get the tiles it can
+attack. The masks of the units of a team are summed into two grids per team:
+
+    attackers - how many units of the team can attack each tile
+    threat - the damage those units can inflict on each tile with a single strike, summed
+
+The grids are updated incrementally: when a unit moves or dies only that unit and the enemies whose reach it can
+block or unblock are recomputed.
+"""
+
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+from map.ranges import dilate
+
+
+class Influence(object):
+    """
+    What a single unit contributes to the influence maps of its team.
+    """
+    __slots__ = ('team', 'reach', 'attack', 'threat', 'stats')
+
+    def __init__(self, team, reach, attack, threat, stats):
+        self.team = team  # grid team index of the unit
+        self.reach = reach  # (h, w) bool: tiles the unit can move to
+        self.attack = attack  # (h, w) bool: tiles the unit can attack after moving
+        self.threat = threat  # damage of a single strike, before the defence of the target
+        self.stats = stats  # what the masks and threat were computed from, see InfluenceMap.stats
+
+
+class InfluenceMap(object):
+    """
+    Per team attackers and threat grids, kept up to date by TileMap.move_unit, TileMap.move_unit_undo and
+    TileMap.kill_unit. Units are recomputed lazily, on the first query after they went stale.
+    """
+
+    def __init__(self, grid, path):
+        """
+        :param grid: the :class:`map.grid.TerrainGrid` of the map
+        :param path: the :class:`map.pathfinder.Pathfinder` used to compute the reach of the units
+        """
+        self.grid = grid
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        grid = self.grid
+        teams = 1 + len(grid.teams)
+        self.attackers = np.zeros((teams, grid.h, grid.w), dtype=np.int16)
+        self.threat = np.zeros((teams, grid.h, grid.w))
+        self.influences: Dict[object, Influence] = {}
+        self.dirty = {unit for unit in grid.units if unit is not None}
+        self.updates = 0  # units recomputed
+
+    @staticmethod
+    def stats(unit) -> Tuple[int, int, int, int]:
+        weapon = unit.weapon
+        might = weapon.might if weapon is not None and weapon.uses > 0 else 0
+        return (unit.movement, unit.strength + might) + unit.get_weapon_range()
+
+    def invalidate(self, unit=None):
+        """
+        Marks unit as stale. Without a unit, checks which units changed movement, strength or weapon since they
+        were computed (level ups, broken weapons, ...), which is cheap enough to do every turn. Moves and deaths are
+        tracked automatically.
+        """
+        if unit is not None:
+            self.dirty.add(unit)
+            return
+        influences = self.influences
+        for unit in self.grid.units:
+            if unit is not None:
+                influence = influences.get(unit)
+                if influence is None or influence.stats != self.stats(unit):
+                    self.dirty.add(unit)
+
+    def moved(self, unit, source, target):
+        """
+        Called after unit moved from source to target.
+        """
+        self.dirty.add(unit)
+        self.__touch(unit, source)
+        self.__touch(unit, target)
+
+    def removed(self, unit, coord):
+        """
+        Called after unit, that was standing on coord, died.
+        """
+        self.dirty.discard(unit)
+        influence = self.influences.pop(unit, None)
+        if influence is not None:
+            self.__apply(influence, -1)
+        self.__touch(unit, coord)
+
+    def __touch(self, unit, coord):
+        # the reach of the enemies of unit changes if coord is in it or next to it, as unit blocks their way
+        grid = self.grid
+        i = grid.index(coord)
+        tiles = (i,) + grid.adjacency[i]
+        team = grid.team_of(unit)
+        for other, influence in self.influences.items():
+            if grid.hostile[influence.team][team] and any(influence.reach.flat[j] for j in tiles):
+                self.dirty.add(other)
+
+    def __apply(self, influence, sign):
+        self.attackers[influence.team] += sign * influence.attack
+        self.threat[influence.team] += sign * influence.threat * influence.attack
+
+    def __compute(self, unit) -> Influence:
+        grid = self.grid
+        stats = movement, threat, min_range, max_range = self.stats(unit)
+        reach = np.zeros(grid.n, dtype=bool)
+        reach[self.path.reach(unit, movement)] = True
+        reach = reach.reshape(grid.h, grid.w)
+        return Influence(grid.team_of(unit), reach, dilate(reach, min_range, max_range), threat, stats)
+
+    def update(self):
+        """
+        Recomputes the stale units.
+        """
+        while self.dirty:
+            unit = self.dirty.pop()
+            influence = self.influences.pop(unit, None)
+            if influence is not None:
+                self.__apply(influence, -1)
+            if self.grid.get_unit(unit.coord) is not unit:
+                continue  # dead
+            influence = self.influences[unit] = self.__compute(unit)
+            self.__apply(influence, +1)
+            self.updates += 1
+
+    def attackable(self, team) -> np.ndarray:
+        """
+        Returns a (h, w) array: how many units of team can attack each tile within their next move.
+        """
+        self.update()
+        return self.attackers[self.grid.team_index[team]]
+
+    def threatened(self, team) -> np.ndarray:
+        """
+        Returns a (h, w) array: the damage the units of team can inflict on each tile within their next move.
+        """
+        self.update()
+        return self.threat[self.grid.team_index[team]]
+
+    def influence(self, unit) -> Influence:
+        """
+        Returns the :class:`Influence` of unit.
+        """
+        self.update()
+        return self.influences[unit]
+
+    def enemies_in_reach(self, unit) -> list:
+        """
+        Returns the enemies unit can attack within its next move.
+        """
+        grid = self.grid
+        return grid.enemies_at(unit, np.flatnonzero(self.influence(unit).attack).tolist())
@@ -21,13 +21,13 @@ from basictypes import Point
 from map.arrow import Arrow
 from map.cellhighlight import CellHighlightLayer
 from map.cursor import Cursor
+from map.grid import TerrainGrid
+from map.influence import InfluenceMap
 from map.pathfinder import Pathfinder, Terrain, manhattan_path
+from map import ranges
 from map.unit import UnitSprite
 from room import Layout, LayoutParams, Background, BackgroundSize
 
-#NEW
-import quantum
-
 Coord = Tuple[int, int]
 
 
@@ -38,13 +38,15 @@ class TileMap(room.Room):
 
     def __init__(self, map_path, **kwargs):
         """
-        
+        :param map_path: the .tmx file to load
+        :param all_ai: if True every team is controlled by the AI, not only those with the AI property
         """
+        all_ai = kwargs.pop('all_ai', False)
         super().__init__(wait=False,
                          background=Background(image=resources.load_image("old-paper.jpg"), size=BackgroundSize.COVER),
                          layout=Layout(width=LayoutParams.FILL_PARENT, height=LayoutParams.FILL_PARENT), **kwargs)
 
-        self.tilemap = tmx.load(map_path, self.rect.size, self.rect.topleft)
+        self.tilemap = tmx.load(map_path, self.rect.size, self.rect.topleft, str(resources.CACHE_PATH))
 
         self.zoom = self.tilemap.zoom = 2
         self.tw, self.th = (self.tilemap.tile_width, self.tilemap.tile_height)
@@ -82,7 +84,7 @@ class TileMap(room.Room):
                     v = layer.properties.get(key, None)
                     return str(resources.MUSIC_PATH / v) if v else None
                 music = {'map': get('map_music'), 'battle': get('battle_music')}
-                if layer.properties.get('AI', None) is None:
+                if layer.properties.get('AI', None) is None and not all_ai:
                     teams[color] = unit.Team(layer.name, color, relation, list(units.values()), boss, music)
                 else:
                     teams[color] = ai.AI(layer.name, color, relation, list(units.values()), boss, music)
@@ -100,10 +102,10 @@ class TileMap(room.Room):
             if isinstance(layer, tmx.Layer):
                 for cell in layer:
                     coord = cell.x, cell.y
-                    units = self.units_manager.get_units(coord=coord)
-                    _unit = units[0] if units else None
                     if coord not in self.terrains and cell.tile is not None:
-                        self.terrains[coord] = Terrain(cell.tile, _unit)
+                        self.terrains[coord] = Terrain(cell.tile)
+
+        self.grid = TerrainGrid(self.w, self.h, self.terrains, self.units_manager.teams)
 
         cursor_layer = tmx.SpriteLayer()
         self.cursor = Cursor(self.tilemap, resources.load_image('cursor.png'), cursor_layer)
@@ -122,22 +124,23 @@ class TileMap(room.Room):
 
         self.prev_sel: Union[None, Coord] = None
         self.curr_sel: Union[None, Coord] = None
-        self.move_area: List[Coord] = []
-        self.attack_area: List[Coord] = []
-        self.entangle_area: List[Coord] = []
+        # (h, w) boolean masks, see map.ranges
+        self.move_area = ranges.area(self.w, self.h)
+        self.attack_area = ranges.area(self.w, self.h)
+        self.entangle_area = ranges.area(self.w, self.h)
 
         # Scroll speed
         self.vx, self.vy = 0, 0
 
-        self.path = Pathfinder(self)
+        self.path = Pathfinder(self.grid)
+        self.influence = InfluenceMap(self.grid, self.path)
         self.return_path = None  # stores the path to undo a move
 
     @property
     def curr_unit(self) -> Union[unit.Unit, None]:
-        try:
-            return self.terrains[self.curr_sel].unit
-        except KeyError:
+        if self.curr_sel is None or not self.check_coord(self.curr_sel):
             return None
+        return self.get_unit(self.curr_sel)
 
     @curr_unit.setter
     def curr_unit(self, _unit: Union[unit.Unit, None]) -> None:
@@ -145,10 +148,9 @@ class TileMap(room.Room):
 
     @property
     def prev_unit(self) -> Union[unit.Unit, None]:
-        try:
-            return self.terrains[self.prev_sel].unit
-        except KeyError:
+        if self.prev_sel is None or not self.check_coord(self.prev_sel):
             return None
+        return self.get_unit(self.prev_sel)
 
     @prev_unit.setter
     def prev_unit(self, _unit: Union[unit.Unit, None]) -> None:
@@ -158,20 +160,7 @@ class TileMap(room.Room):
         return self.terrains[coord]
 
     def is_obstacle(self, coord, for_unit=None):
-        terrain = self.terrains[coord]
-        try:
-            return self.units_manager.are_enemies(for_unit, terrain.unit)
-        except AttributeError:
-            if for_unit is None:
-                return False
-            for allowed in terrain.allowed:
-                if allowed == 'any':
-                    return False
-                if allowed == 'none':
-                    return True
-                if allowed in for_unit.ALLOWED_TERRAINS:
-                    return False
-            return True
+        return self.grid.is_obstacle(coord, for_unit)
 
     def check_coord(self, coord):
         x, y = coord
@@ -239,10 +228,28 @@ class TileMap(room.Room):
         if who.coord != where:
             if self.get_unit(where) is not None:
                 raise ValueError("Destination %s is already occupied by another unit" % str(where))
-            self.terrains[who.coord].unit = None
-            self.terrains[where].unit = who
+            self.grid.move(who, who.coord, where)
             print(_('Unit %s moved from %s to %s') % (who.name, who.coord, where))
+            source = who.coord
             who.move(where)
+            self.influence.moved(who, source, where)
+
+    def swap_units(self, a: unit.Unit, b: unit.Unit) -> None:
+        """
+        Swaps the places of two units at once, so that neither needs a free tile to step aside on.
+        :param a: a unit on the map
+        :param b: another unit on the map
+        """
+        source, target = a.coord, b.coord
+        self.grid.remove(source)
+        self.grid.remove(target)
+        self.grid.place(a, target)
+        self.grid.place(b, source)
+        print(_('Units %s and %s swapped places') % (a.name, b.name))
+        a.move(target)
+        b.move(source)
+        self.influence.moved(a, source, target)
+        self.influence.moved(b, target, source)
 
     def move_unit_undo(self):
         if self.curr_sel != self.prev_sel:
@@ -251,19 +258,20 @@ class TileMap(room.Room):
                 animation = self.make_move_unit_animation(_unit, self.prev_sel, self.return_path)
                 self.add_move_unit_animation(animation)
                 self.return_path = None
-            self.terrains[self.prev_sel].unit = _unit
-            self.terrains[self.curr_sel].unit = None
+            self.grid.move(_unit, self.curr_sel, self.prev_sel)
             _unit.move(self.prev_sel)
+            self.influence.moved(_unit, self.curr_sel, self.prev_sel)
         self.reset_selection()
 
     def kill_unit(self, _unit):
         self.units_manager.kill_unit(_unit)
-        self.terrains[_unit.coord].unit = None
+        self.grid.remove(_unit.coord)
+        self.influence.removed(_unit, _unit.coord)
         sprite = self.find_sprite(unit=_unit)
         self.sprites_layer.remove(sprite)
 
     def get_unit(self, coord):
-        return self.terrains[coord].unit
+        return self.grid.get_unit(coord)
 
     def find_sprite(self, **kwargs) -> UnitSprite:
         unit_sprite: UnitSprite
@@ -273,22 +281,19 @@ class TileMap(room.Room):
                     return unit_sprite
 
     def path_cost(self, path):
-        cost = 0
-        for coord in path:
-            cost += self.terrains[coord].moves
-        return cost
+        return self.grid.path_cost(path)
 
     def update_arrow(self, target=None):
         if self.curr_unit and not self.curr_unit.played \
                 and self.units_manager.active_team.is_mine(self.curr_unit) and target:
             target_unit = self.get_unit(target)
-            if target in self.move_area:
+            if ranges.contains(self.move_area, target):
                 self.arrow.source = self.curr_sel
                 self.arrow.add_or_remove_coord(target)
                 if self.path_cost(self.arrow.path) > self.curr_unit.movement or target not in self.arrow.path:
                     path = self.path.shortest_path(self.curr_sel, target, self.curr_unit.movement)
                     self.arrow.set_path(path, self.curr_sel)
-            elif target in self.attack_area and target_unit:
+            elif ranges.contains(self.attack_area, target) and target_unit:
                 if not self.arrow.path or target_unit not in self.nearby_enemies(self.curr_unit, self.arrow.path[-1]):
                     path = self.path.shortest_path(self.curr_sel, target, self.curr_unit.movement)
                 else:
@@ -303,15 +308,10 @@ class TileMap(room.Room):
     def update_highlight(self):
         played = [u.coord for u in self.units_manager.active_team.list_played()]
         self.highlight_layer.update(self.curr_sel, self.move_area, self.attack_area, self.entangle_area, played)
-        self.invalidate()
 
     def area(self, center, radius, hole=0):
-        x, y = center
-        _area = [(i, j) for i in range(x - radius, x + radius + 1)
-                 for j in range(y - radius, y + radius + 1)
-                 if self.check_coord((i, j))
-                 and hole <= utils.distance((x, y), (i, j)) <= radius]
-        return _area
+        coords = self.grid.coords
+        return [coords[i] for i in self.grid.ring(center, radius, hole)]
 
     def nearby_enemies(self, _unit=None, coord=None):
         """
@@ -322,20 +322,14 @@ class TileMap(room.Room):
         if not coord:
             coord = _unit.coord
         min_range, max_range = _unit.get_weapon_range()
-        area = self.area(coord, max_range, min_range)
-        nearby_list = []
-        for u in area:
-            c_unit = self.get_unit(u)
-            if c_unit and self.units_manager.are_enemies(c_unit, _unit):
-                nearby_list.append(c_unit)
-        return nearby_list
+        return self.grid.enemies_at(_unit, self.grid.ring(coord, max_range, min_range))
 
     def reset_selection(self):
         logging.debug('Selection reset')
         self.curr_sel = None
         self.prev_sel = None
-        self.move_area = []
-        self.attack_area = []
+        self.move_area = ranges.area(self.w, self.h)
+        self.attack_area = ranges.area(self.w, self.h)
         self.arrow.set_path([])
         self.update_highlight()
 
@@ -365,7 +359,6 @@ class TileMap(room.Room):
             coord = self.tilemap.index_at(x, y)
             if coord and coord != self.cursor.coord:
                 self.cursor.point(*coord)
-                self.invalidate()
                 if self.children_done():
                     self.update_arrow(coord)
 
@@ -396,7 +389,6 @@ class TileMap(room.Room):
 
         if event.key == pygame.K_SPACE:
             self.select(self.cursor.coord)
-        self.invalidate()
 
     def layout_children(self, rect):
         if self.tilemap.viewport.size != rect.size:
@@ -421,54 +413,61 @@ class TileMap(room.Room):
             self.arrow.update()
             self.update_highlight()
             self.fill()
+        self.invalidate_tiles()
+
+    def invalidate_tiles(self) -> None:
+        """
+        Invalidates the parts of the map that changed since the last frame: the tiles of the sprites that moved or were
+        updated, of the highlights and of the cursor. Everything if the view scrolled or zoomed.
+        """
+        rects = self.tilemap.changed()
+        if rects is None:
+            self.invalidate()
+        else:
+            for rect in utils.merge_rects(rects):
+                self.invalidate(rect)
 
     def draw(self):
-        self.tilemap.draw(self.surface)
+        if self.dirty is None:
+            self.tilemap.draw(self.surface)
+        else:
+            clip = self.surface.get_clip()
+            areas = self.dirty if len(self.dirty) <= 8 else [self.dirty[0].unionall(self.dirty[1:])]
+            for area in areas:
+                self.surface.set_clip(area.clip(clip))
+                self.tilemap.draw(self.surface)
+            self.surface.set_clip(clip)
         self.draw_children()
         self.valid = True
-        self.surface = self.surface.convert()
-
-    def __set_attack_area(self, coord: Tuple[int, int], min_range: int, max_range: int):
-        # Auxiliary method for update_move_attack_area and update_still_attack_area
-        x, y = coord
-        for i in range(x - max_range, x + max_range + 1):
-            for j in range(y - max_range, y + max_range + 1):
-                if self.check_coord((i, j)) and (i, j) not in self.move_area and (i, j) not in self.attack_area:
-                    if min_range <= utils.distance((x, y), (i, j)) <= max_range:
-                        self.attack_area.append((i, j))
 
     def update_move_attack_area(self, _unit: Optional[unit.Unit]):
         """
         Updates the area which will be highlighted on the map to show how far unit can move and attack.
         """
         if _unit is not None and not _unit.played:
-            self.move_area = self.path.area(_unit.coord, _unit.movement)
+            self.move_area = ranges.area(self.w, self.h, self.path.area(_unit.coord, _unit.movement))
             min_range, max_range = _unit.get_weapon_range()
-            self.attack_area = []
-            for coord in self.move_area:
-                self.__set_attack_area(coord, min_range, max_range)
+            self.attack_area = ranges.dilate(self.move_area, min_range, max_range) & ~self.move_area
         else:
-            self.move_area = []
-            self.attack_area = []
+            self.move_area = ranges.area(self.w, self.h)
+            self.attack_area = ranges.area(self.w, self.h)
 
     def update_still_attack_area(self, _unit: Optional[unit.Unit]):
         """
         Update the area which will be highlighted on the map to show
         how far the selected unit can attack with her weapon
         """
+        self.move_area = ranges.area(self.w, self.h)
         if _unit is not None and not _unit.played:
             min_range, max_range = self.curr_unit.get_weapon_range()
-            self.attack_area = []
-            self.move_area = []
-            self.__set_attack_area(self.curr_sel, min_range, max_range)
+            self.attack_area = ranges.dilate(ranges.area(self.w, self.h, [self.curr_sel]), min_range, max_range)
         else:
-            self.attack_area = []
-            self.move_area = []
+            self.attack_area = ranges.area(self.w, self.h)
 
     def can_selection_move(self):
         return (self.prev_unit is not None and not self.prev_unit.played and
                 self.units_manager.active_team.is_mine(self.prev_unit) and
-                self.curr_sel in self.move_area)
+                ranges.contains(self.move_area, self.curr_sel))
 
     def move_then_action_menu(self, target: Optional[Tuple[int, int]] = None):
         if target is None:
@@ -504,7 +503,7 @@ class TileMap(room.Room):
             elif self.prev_sel == self.curr_sel:
                 # Two times on the same playable unit. Show the action menu.
                 self.action_menu()
-            elif self.curr_sel in self.attack_area:
+            elif ranges.contains(self.attack_area, self.curr_sel):
                 # Two different units: prev_unit can attack curr_unit
                 # This results in a combined action: move the unit next to the enemy and propose the user to attack
                 nearest = self.arrow.path[-1] if self.arrow.path else self.prev_sel
@@ -539,8 +538,8 @@ class TileMap(room.Room):
     def prepare_attack(self, _unit=None):
         if not _unit:
             _unit = self.curr_unit
-        self.move_area = []
-        self.attack_area = [u.coord for u in self.nearby_enemies(_unit, _unit.coord)]
+        self.move_area = ranges.area(self.w, self.h)
+        self.attack_area = ranges.area(self.w, self.h, [u.coord for u in self.nearby_enemies(_unit, _unit.coord)])
         self.update_highlight()
 
     def attack(self, attacking=None, defending=None):
@@ -551,18 +550,10 @@ class TileMap(room.Room):
 
         if attacking.entangled is not None:
             if coords := attacking.collapse(): # don't be fooled, this function is as dirty as it gets!
-                # might have to move to an intermediate square
-                # yup!
                 print(f"Attacker is at ({coords[0]}) Sanity check: {attacking.coord == coords[0]}")
                 other_unit = self.get_unit(coords[1])
                 print(f"Defender is at ({coords[1]}) Sanity check: {other_unit.coord == coords[1]}")
-                self.update_move_attack_area(attacking)
-
-
-                print(f"Attempting to move attacker to ({self.move_area[0]})")
-                self.move_unit(attacking, self.move_area[0]) # erm... might want to double check to make sure the intermediary tile is a bit safer
-                self.move_unit(other_unit, coords[0])
-                self.move_unit(attacking, coords[1])
+                self.swap_units(attacking, other_unit)
 
                 self.find_sprite(unit=attacking).reposition()
                 self.find_sprite(unit=other_unit).reposition()
@@ -570,11 +561,7 @@ class TileMap(room.Room):
             if coords := defending.collapse(): # *chuckles* I'm in danger
 
                 other_unit = self.get_unit(coords[1])
-                self.update_move_attack_area(defending)
-
-                self.move_unit(defending, self.move_area[0])
-                self.move_unit(other_unit, coords[0])
-                self.move_unit(defending, coords[1])
+                self.swap_units(defending, other_unit)
 
                 self.find_sprite(unit=defending).reposition()
                 self.find_sprite(unit=other_unit).reposition()
@@ -591,8 +578,9 @@ class TileMap(room.Room):
     def prepare_entangle(self, _unit=None):
         if not _unit:
             _unit = self.curr_unit
-        self.move_area = []
-        self.entangle_area = [unit.coord for unit in self.units_manager.active_team.units if unit != self.curr_unit]
+        self.move_area = ranges.area(self.w, self.h)
+        self.entangle_area = ranges.area(self.w, self.h, [unit.coord for unit in self.units_manager.active_team.units
+                                                          if unit != self.curr_unit])
         self.update_highlight()
 
     def entangle(self, parent=None, child=None):
@@ -605,9 +593,14 @@ class TileMap(room.Room):
 
         assert(parent != child)
 
+        # main.py imports quantum at startup to choose the backend: only qiskit and azure-quantum are deferred, to the
+        # backend's warm-up or its first circuit
+        import quantum
+
         # let the ~~battle~~ entanglement begin!
         # change to arbitrary attribute select later
         event = quantum.Quantum(parent, child, quantum.Attributes.position)
+        event.submit()  # runs with the other entanglements of this turn when the turn ends
         parent.entangle(event)
         child.entangle(event)
 
@@ -618,20 +611,20 @@ class TileMap(room.Room):
 
     def is_attack_click(self, mouse_pos):
         coord = self.tilemap.index_at(*mouse_pos)
-        return self.rect.collidepoint(mouse_pos) and coord in self.attack_area
+        return self.rect.collidepoint(mouse_pos) and ranges.contains(self.attack_area, coord)
 
     #NEW
     def is_entangle_click(self, mouse_pos):
         coord = self.tilemap.index_at(*mouse_pos)
-        return self.rect.collidepoint(mouse_pos) and coord in self.entangle_area
+        return self.rect.collidepoint(mouse_pos) and ranges.contains(self.entangle_area, coord)
 
 
     def is_enemy_cursor(self):
-        return self.cursor.coord in self.attack_area
+        return ranges.contains(self.attack_area, self.cursor.coord)
 
     #NEW
     def is_ally_cursor(self):
-        return self.cursor.coord in self.entangle_area
+        return ranges.contains(self.entangle_area, self.cursor.coord)
 
     def do_action(self, _action: action.Action) -> None:
         """
@@ -729,7 +722,6 @@ class MoveCursorAnimation(room.Room):
         self.parent: TileMap
         try:
             self.parent.cursor.point(*next(self.path))
-            self.parent.invalidate()
         except StopIteration:
             self.done = True
 
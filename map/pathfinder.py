@@ -3,138 +3,345 @@
 """
 
 
+import bisect
 import heapq
 
+from collections import OrderedDict
+
 
 class Terrain(object):
-    def __init__(self, tile, unit):
+    def __init__(self, tile):
         self.name = tile.properties.get('name', 'Unknown')
         self.moves = float(tile.properties.get('moves', 1))  # how many moves are required to move a unit through
         self.defense = int(tile.properties.get('defense', 0))  # bonus defense
         self.avoid = int(tile.properties.get('avoid', 0))  # bonus avoid
         self.allowed = tile.properties.get('allowed', 'earth').split(',')
         self.surface = tile.surface
-        self.unit = unit
+
+
+class DistanceField(object):
+    """
+    Output of a Dijkstra run: distance and predecessor of every node from a source.
+    """
+    __slots__ = ('source', 'dist', 'prev', 'order', 'order_dist', 'stamp')
+
+    def __init__(self, source, dist, prev, order, order_dist, stamp):
+        self.source = source  # int tuple: dijkstra executed with this node as source
+        self.dist = dist  # list: distance from source, indexed by node index
+        self.prev = prev  # list: previous node index or, for obstacles, heap of (distance, coord, index)
+        self.order = order  # list: reached node indexes in the order they were settled
+        self.order_dist = order_dist  # list: distance of each node in order
+        self.stamp = stamp  # grid version the field was computed at
+
+
+class EnemyField(object):
+    """
+    Output of a multi-source Dijkstra run seeded with all the enemies of a team: for every node, the cost to reach
+    the nearest enemy, which enemy that is and the next step to take to get there.
+    """
+    __slots__ = ('dist', 'next', 'nearest', 'stamp')
+
+    def __init__(self, dist, _next, nearest, stamp):
+        self.dist = dist  # list: cost to reach the nearest enemy, indexed by node index
+        self.next = _next  # list: neighbour index one step closer to the nearest enemy, -1 if none
+        self.nearest = nearest  # list: node index of the nearest enemy, -1 if unreachable
+        self.stamp = stamp  # grid version the field was computed at
 
 
 class Pathfinder(object):
-    """Cached pathfinder"""
-    def __init__(self, _map):
-        self.map = _map
-        self.w, self.h = self.map.w, self.map.h
+    """
+    Cached pathfinder.
+
+    Distance fields are kept in a LRU cache keyed by (source, movement class, team, enemies). A field only depends on
+    where the units hostile to its team are and on which tiles its movement class can't cross have a unit on them,
+    so it stays valid until one of those changes; see TerrainGrid.stamp.
+    """
+    def __init__(self, grid, capacity=64):
+        """
+        :param grid: the :class:`map.grid.TerrainGrid` to search. Only its arrays are read.
+        :param capacity: how many distance fields to keep
+        """
+        self.grid = grid
+        self.w, self.h = grid.w, grid.h
+        self.coords = grid.coords
+        self.index = grid.index
+        self.capacity = capacity
         self.reset()
 
     def reset(self):
-        self.source = None  # int tuple: dijkstra executed with this node as source
-        self.target = None  # int tuple: shortest path target
-        self.shortest = None  # list: shortest path output
-        self.max_distance = None  # float
-        self.dist = None  # dict: results of dijkstra
-        self.prev = None
-        self.enemies = None  # bool: treat enemies as obstacles
+        self.cache = OrderedDict()
+        self.enemy_fields = {}  # (movement class, team) -> EnemyField
+        self.hits = 0  # queries answered from the cache
+        self.misses = 0  # queries that ran dijkstra
+        self.invalidations = 0  # misses caused by a unit that moved or died
+        self.expanded = 0  # tiles settled by all the searches so far: the work done, whatever the machine
 
-    def __set_source(self, source, enemies=True):
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __key(self, source, enemies):
+        source_unit = self.grid.get_unit(source) if enemies else None
+        if source_unit is None:
+            # nothing is an obstacle: the field is the same for everyone
+            return (tuple(source), None, None, False), None, None
+        team = self.grid.team_of(source_unit)
+        key = (tuple(source), self.grid.movement_class(source_unit), team, True)
+        return key, source_unit, team
+
+    def field(self, source, enemies=True):
+        """
+        Returns the :class:`DistanceField` of source, running dijkstra only if it isn't cached or a unit it depends
+        on moved since it was computed.
+        """
+        key, source_unit, team = self.__key(source, enemies)
+        stamp = self.grid.stamp(team, key[1])
+        field = self.cache.get(key)
+        if field is not None:
+            if field.stamp == stamp:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return field
+            self.invalidations += 1
+        self.misses += 1
+        field = self.__dijkstra(source, source_unit, stamp)
+        self.cache[key] = field
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+        return field
+
+    def __dijkstra(self, source, source_unit, stamp):
         """
-        Implementation of Dijkstra's Algorithm.
+        Implementation of Dijkstra's Algorithm with a binary heap.
         See https://en.wikipedia.org/wiki/Dijkstra%27s_algorithm for
         reference.
         This method computes the distance of every node of the map from
         a given source node.
+
+        The heap is ordered by (distance, node index) and stale entries
+        are skipped when popped (lazy deletion), so nodes are settled in
+        exactly the same order as a linear scan over the unvisited nodes
+        would settle them.
         """
-        self.shortest = None
-        self.source = source
-        self.enemies = enemies
+        grid = self.grid
+        n = grid.n
+        moves, adjacency = grid.moves, grid.adjacency
 
         # Unknown distance function from source to v
-        self.dist = {(x, y): float('inf') for y in range(self.h) for x in range(self.w)}
+        dist = [float('inf')] * n
         # Previous node in optimal path from source initialization
-        self.prev = {(x, y): None for y in range(self.h) for x in range(self.w)}
+        prev = [None] * n
+        visited = bytearray(n)
+        order, order_dist = [], []
+
+        s = self.index(source)
+        dist[s] = 0  # Distance from source to source
+        Q = [(0, s)]
 
-        self.dist[source] = 0  # Distance from source to source
+        blocked = grid.blocked(source_unit)
 
-        # All nodes initially in Q (unvisited nodes)
-        Q = [v for v in self.dist]
+        while Q:
+            d, u = heapq.heappop(Q)
+            if visited[u]:
+                continue  # stale entry: u was already settled with a shorter distance
+            visited[u] = 1
+            order.append(u)
+            order_dist.append(d)
 
-        source_unit = self.map[source].unit if enemies else None
+            for v in adjacency[u]:
+                alt = d + moves[v]
+                if alt < dist[v]:
+                    # A shorter path to v has been found
+                    if blocked[v]:
+                        # v is an obstacle: its distance stays infinite (unreachable)
+                        # but we still want to be able to find a path, so keep
+                        # the shortest way in first
+                        if not prev[v]:
+                            prev[v] = [(alt, grid.coords[u], u)]
+                        else:
+                            heapq.heappush(prev[v], (alt, grid.coords[u], u))
+                    else:
+                        dist[v] = alt
+                        prev[v] = u
+                        heapq.heappush(Q, (alt, v))
 
+        self.expanded += len(order)
+        return DistanceField(source, dist, prev, order, order_dist, stamp)
+
+    def reach(self, unit, max_distance):
+        """
+        Returns the indexes of the tiles unit can reach spending at most max_distance moves, like area but without
+        computing (or caching) the distance of the rest of the map.
+        """
+        grid = self.grid
+        moves, adjacency = grid.moves, grid.adjacency
+        blocked = grid.blocked(unit)
+        s = self.index(unit.coord)
+        dist = {s: 0}
+        reached = []
+        Q = [(0, s)]
         while Q:
-            min_dist = self.dist[Q[0]]
-            u = Q[0]
+            d, u = heapq.heappop(Q)
+            if d > dist[u]:
+                continue  # stale entry
+            reached.append(u)
+            for v in adjacency[u]:
+                alt = d + moves[v]
+                if alt <= max_distance and alt < dist.get(v, alt + 1) and not blocked[v]:
+                    dist[v] = alt
+                    heapq.heappush(Q, (alt, v))
+        self.expanded += len(reached)
+        return reached
 
-            for el in Q:
-                if self.dist[el] < min_dist:
-                    min_dist = self.dist[el]
-                    u = el  # Source node in first case
+    def enemy_field(self, unit):
+        """
+        Returns the :class:`EnemyField` of the units of the same team and movement class as unit. There is only one
+        per team and movement class, and it is recomputed only when an enemy moves or dies.
+        """
+        grid = self.grid
+        team = grid.team_of(unit)
+        key = (grid.movement_class(unit), team)
+        stamp = grid.stamp(team, key[0])
+        field = self.enemy_fields.get(key)
+        if field is not None and field.stamp == stamp:
+            self.hits += 1
+            return field
+        if field is not None:
+            self.invalidations += 1
+        self.misses += 1
+        hostile, occupancy = grid.hostile[team], grid.occupancy
+        seeds = [i for i in range(grid.n) if hostile[occupancy[i]]]
+        field = self.enemy_fields[key] = self.__reverse_dijkstra(seeds, grid.blocked(unit), stamp)
+        return field
 
-            Q.remove(u)
+    def __reverse_dijkstra(self, seeds, blocked, stamp):
+        """
+        Dijkstra's Algorithm run backwards from all seeds at once: the distance of a node is the cost of walking from
+        it to the nearest seed, entering every tile on the way (seed included) like a unit would.
+        """
+        grid = self.grid
+        n = grid.n
+        moves, adjacency = grid.moves, grid.adjacency
 
-            # where v has not yet been removed from Q.
-            for v in self.map.neighbors(u):
-                alt = self.dist[u] + self.map[v].moves
-                if alt < self.dist[v]:
-                    # A shorter path to v has been found
-                    if self.map.is_obstacle(v, source_unit):
-                        # v is an obstacle set infinite distance (unreachable)
-                        self.dist[v] = float('inf')
-                        # we still want to be able to find a path
-                        if not self.prev[v]:
-                            self.prev[v] = [(alt, u)]
-                        else:  # keep the shortest first
-                            heapq.heappush(self.prev[v], (alt, u))
-                    else:
-                        self.dist[v] = alt
-                        self.prev[v] = u
+        dist = [float('inf')] * n
+        _next = [-1] * n
+        nearest = [-1] * n
+        visited = bytearray(n)
+
+        for s in seeds:
+            dist[s] = 0
+            nearest[s] = s
+        Q = [(0, s) for s in seeds]
+        heapq.heapify(Q)
+
+        while Q:
+            d, u = heapq.heappop(Q)
+            if visited[u]:
+                continue
+            visited[u] = 1
+            alt = d + moves[u]  # stepping into u from any of its neighbours
+            for v in adjacency[u]:
+                if alt < dist[v] and not blocked[v]:
+                    dist[v] = alt
+                    _next[v] = u
+                    nearest[v] = nearest[u]
+                    heapq.heappush(Q, (alt, v))
+
+        self.expanded += visited.count(1)
+        return EnemyField(dist, _next, nearest, stamp)
+
+    def nearest_enemy(self, unit):
+        """
+        Returns the enemy unit can reach with the least moves or None if no enemy can be reached.
+        """
+        nearest = self.enemy_field(unit).nearest[self.index(unit.coord)]
+        return self.grid.units[nearest] if nearest >= 0 else self.__nearest_through_obstacles(unit)
 
-    def __set_target(self, target, max_distance=float('inf'), enemies=True):
+    def __nearest_through_obstacles(self, unit):
         """
-        This method sets the target node and the maximum distance. The
-        computed path total cost will not exceed the maximim distance.
-        The shortest path between target and source previously specified
-        with __set_source is returned as a list.
+        Returns the enemy with the shortest path from unit when every route is blocked, walking through the obstacles
+        like shortest_path does, or None if unit has no enemies.
         """
-        self.max_distance = max_distance
+        grid = self.grid
+        hostile, occupancy = grid.hostile[grid.team_of(unit)], grid.occupancy
+        enemies = [grid.units[i] for i in range(grid.n) if hostile[occupancy[i]]]
+        if not enemies:
+            return None
+        return min(enemies, key=lambda enemy: len(self.shortest_path(unit.coord, enemy.coord)))
+
+    def enemy_distance(self, unit) -> float:
+        """
+        Returns how many moves unit needs to reach its nearest enemy.
+        """
+        return self.enemy_field(unit).dist[self.index(unit.coord)]
+
+    def toward_nearest_enemy(self, unit, max_distance=float('inf')):
+        """
+        Follows the gradient of the enemy field from unit towards the nearest enemy. Returns the path as a list of
+        coords like shortest_path would: at most max_distance moves long and not ending on an occupied tile.
+        If no enemy can be reached, it is the shortest path through the obstacles to the nearest one.
+        """
+        grid = self.grid
+        field = self.enemy_field(unit)
+        if field.nearest[self.index(unit.coord)] < 0:
+            target = self.__nearest_through_obstacles(unit)
+            return self.shortest_path(unit.coord, target.coord, max_distance) if target else []
+        moves, _next, coords = grid.moves, field.next, self.coords
         S = []
-        u = self.target = target
-        self.enemies = enemies
-
-        # Construct the shortest path with a stack S
-        while self.prev[u] is not None:
-            if self.dist[u] <= max_distance:
-                S.insert(0, u)  # Push the vertex onto the stack
-            try:
-                u = self.prev[u][0][1]  # get the shorter path
-            except TypeError:
-                u = self.prev[u]  # Traverse from target to source
-
-        s_unit = self.map[self.source].unit if enemies else None
-        for coord in reversed(S):
-            unit = self.map[coord].unit
-            if unit or self.map.is_obstacle(coord, s_unit):
-                del S[-1]
-            else:
+        cost = 0
+        u = _next[self.index(unit.coord)]
+        while u >= 0 and field.dist[u] > 0:
+            cost += moves[u]
+            if cost > max_distance:
                 break
+            S.append(coords[u])
+            u = _next[u]
+
+        while S and (grid.occupancy[self.index(S[-1])] or grid.is_obstacle(S[-1], unit)):
+            del S[-1]
+        return S
+
+    def __path(self, field, target, max_distance, enemies):
+        """
+        The shortest path between the source of field and target as a list. The computed path total cost will not
+        exceed max_distance and the path doesn't end on an occupied tile or an obstacle.
+        """
+        S = []
+        u = self.index(target)
+        dist, prev = field.dist, field.prev
+
+        # Construct the shortest path walking back from target to source
+        while prev[u] is not None:
+            if dist[u] <= max_distance:
+                S.append(self.coords[u])
+            p = prev[u]
+            if isinstance(p, list):
+                u = p[0][2]  # obstacle: get the shorter path
+            else:
+                u = p  # Traverse from target to source
+        S.reverse()
+
+        grid = self.grid
+        s_unit = grid.get_unit(field.source) if enemies else None
+        while S and (grid.occupancy[self.index(S[-1])] or grid.is_obstacle(S[-1], s_unit)):
+            del S[-1]
 
-        self.shortest = S
         return S
 
     def shortest_path(self, source, target, max_distance=float('inf'), enemies=True):
-        if self.source != source or self.enemies != enemies:
-            self.__set_source(source, enemies)
-            self.__set_target(target, max_distance, enemies)
-        elif self.target != target or self.max_distance != max_distance or self.enemies != enemies:
-            self.__set_target(target, max_distance, enemies)
-        return self.shortest
+        return self.__path(self.field(source, enemies), target, max_distance, enemies)
 
     def area(self, source, max_distance, enemies=True):
         """
         Returns a list of coords
         """
-        if self.source != source or self.enemies != enemies:
-            self.__set_source(source, enemies)
-            self.target = None
-            self.shortest = None
-        h, w = range(self.h), range(self.w)
-        return [(i, j) for j in h for i in w if self.dist[(i, j)] <= max_distance]
+        field = self.field(source, enemies)
+        reached = field.order[:bisect.bisect_right(field.order_dist, max_distance)]
+        reached.sort()
+        coords = self.coords
+        return [coords[i] for i in reached]
 
 
 def manhattan_path(source, target):
@@ -147,3 +354,112 @@ def manhattan_path(source, target):
         yield from manhattan_path((source[0], source[1] + 1), target)
     elif source[1] > target[1]:
         yield from manhattan_path((source[0], source[1] - 1), target)
+
+
+if __name__ == '__main__':
+    # Benchmark: heap based Dijkstra against the old linear scan over the unvisited nodes.
+    # Run with: python map/pathfinder.py
+    import random
+    import timeit
+
+    from grid import TerrainGrid  # run as a script: this directory is on sys.path
+
+    class BenchTeam(object):
+        def __init__(self, relation):
+            self.relation = relation
+            self.units = []
+
+        def is_enemy(self, team):
+            return abs(team.relation - self.relation) > 1
+
+    class BenchUnit(object):
+        ALLOWED_TERRAINS = ['earth']
+
+        def __init__(self, team, coord):
+            self.team = team
+            self.coord = coord
+            team.units.append(self)
+
+    class BenchTerrain(object):
+        def __init__(self, moves, unit):
+            self.moves = moves
+            self.defense = self.avoid = 0
+            self.allowed = ['earth']
+            self.unit = unit
+
+    class BenchMap(object):
+        """Square map with random terrain costs and a few enemy units scattered around."""
+        def __init__(self, size, seed=0):
+            rng = random.Random(seed)
+            self.w = self.h = size
+            self.teams = [BenchTeam(0), BenchTeam(10)]
+            self.terrains = {}
+            for y in range(size):
+                for x in range(size):
+                    unit = BenchUnit(self.teams[1], (x, y)) if rng.random() < 0.02 and (x, y) != (0, 0) else None
+                    self.terrains[x, y] = BenchTerrain(float(rng.choice([1, 1, 1, 2, 3])), unit)
+            self.terrains[0, 0].unit = BenchUnit(self.teams[0], (0, 0))
+            self.grid = TerrainGrid(size, size, self.terrains, self.teams)
+
+        def __getitem__(self, coord):
+            return self.terrains[coord]
+
+        def is_obstacle(self, coord, for_unit=None):
+            unit = self.terrains[coord].unit
+            return for_unit is not None and unit is not None and unit.team.is_enemy(for_unit.team)
+
+        def neighbors(self, coord):
+            x, y = coord
+            n = [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]
+            return [(i, j) for i, j in n if 0 <= i < self.w and 0 <= j < self.h]
+
+    def scan_dijkstra(_map, source):
+        """The previous O(V^2) implementation, kept here as a reference."""
+        dist = {(x, y): float('inf') for y in range(_map.h) for x in range(_map.w)}
+        prev = {(x, y): None for y in range(_map.h) for x in range(_map.w)}
+        dist[source] = 0
+        Q = [v for v in dist]
+        source_unit = _map[source].unit
+        while Q:
+            min_dist = dist[Q[0]]
+            u = Q[0]
+            for el in Q:
+                if dist[el] < min_dist:
+                    min_dist = dist[el]
+                    u = el
+            Q.remove(u)
+            for v in _map.neighbors(u):
+                alt = dist[u] + _map[v].moves
+                if alt < dist[v]:
+                    if _map.is_obstacle(v, source_unit):
+                        dist[v] = float('inf')
+                        if not prev[v]:
+                            prev[v] = [(alt, u)]
+                        else:
+                            heapq.heappush(prev[v], (alt, u))
+                    else:
+                        dist[v] = alt
+                        prev[v] = u
+        return dist, prev
+
+    print("%6s %12s %12s %8s" % ("size", "scan (ms)", "heap (ms)", "speedup"))
+    for size in (10, 15, 20, 30, 45, 60):
+        bench_map = BenchMap(size)
+        pathfinder = Pathfinder(bench_map.grid)
+        target = (size - 1, size - 1)
+
+        dist, prev = scan_dijkstra(bench_map, (0, 0))
+        field = pathfinder.field((0, 0))
+        assert [dist[c] for c in pathfinder.coords] == field.dist
+        for c, p in zip(pathfinder.coords, field.prev):
+            assert (p is None and prev[c] is None) or (isinstance(p, int) and pathfinder.coords[p] == prev[c]) \
+                or p[0][:2] == prev[c][0]
+
+        repeat = max(1, 600 // (size * size))
+        scan = timeit.timeit(lambda: scan_dijkstra(bench_map, (0, 0)), number=repeat) / repeat
+
+        def heap():
+            pathfinder.reset()
+            pathfinder.shortest_path((0, 0), target)
+        fast = timeit.timeit(heap, number=repeat * 10) / (repeat * 10)
+        print("%6s %12.2f %12.2f %7.0fx" % ("%dx%d" % (size, size), scan * 1000, fast * 1000, scan / fast))
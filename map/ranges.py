@@ -0,0 +1,62 @@
+"""
+Range queries on the map grid: which tiles are within a Manhattan distance band from a tile or from a set of tiles.
+
+Every (min_range, max_range) band has a kernel, the offsets whose Manhattan length is in it, computed once (see
+map.grid.kernel, which TerrainGrid.ring moves around a tile). Areas are (h, w) boolean masks: an attack area is the
+move area dilated by the kernel of the weapon range.
+"""
+
+
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from map.grid import kernel
+
+
+Coord = Tuple[int, int]
+
+
+def dilate(mask: np.ndarray, min_range: int, max_range: int) -> np.ndarray:
+    """
+    Returns the tiles at a distance between min_range and max_range from any tile of a (h, w) boolean mask.
+    """
+    h, w = mask.shape
+    out = np.zeros_like(mask)
+    for dx, dy in kernel(min_range, max_range):
+        if abs(dx) >= w or abs(dy) >= h:
+            continue
+        out[max(dy, 0):h + min(dy, 0), max(dx, 0):w + min(dx, 0)] |= \
+            mask[max(-dy, 0):h + min(-dy, 0), max(-dx, 0):w + min(-dx, 0)]
+    return out
+
+
+def area(w: int, h: int, coords: Iterable[Coord] = ()) -> np.ndarray:
+    """
+    Returns the (h, w) boolean mask of coords.
+    """
+    mask = np.zeros((h, w), dtype=bool)
+    coords = list(coords)
+    if coords:
+        xs, ys = zip(*coords)
+        mask[list(ys), list(xs)] = True
+    return mask
+
+
+def coords(mask: np.ndarray) -> List[Coord]:
+    """
+    Returns the coords of the tiles in mask, row by row.
+    """
+    ys, xs = np.nonzero(mask)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+def contains(mask: np.ndarray, coord: Coord) -> bool:
+    """
+    Returns whether coord is in mask. None and coords outside the map are in no area.
+    """
+    if coord is None:
+        return False
+    h, w = mask.shape
+    x, y = coord
+    return 0 <= x < w and 0 <= y < h and bool(mask[y, x])
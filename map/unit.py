@@ -6,14 +6,105 @@
 import pygame
 import logging
 
+from collections import OrderedDict
+from typing import Dict, Tuple
+
 import utils
 import colors as c
 from basictypes import Point
 
 
+HP_BAR_HEIGHT = 5
+
+
+class PortraitCache(object):
+    """
+    Unit portraits scaled to the size of a sprite, shared by every UnitSprite. Portraits are keyed by the source image
+    and the target size and evicted least recently used first once they take more than capacity bytes.
+    """
+
+    def __init__(self, capacity: int = 32 * 1024 * 1024):
+        """
+        :param capacity: bytes of scaled portraits to keep
+        """
+        self.capacity = capacity
+        self.cache = OrderedDict()  # (id(source), size) -> (source, scaled Surface)
+        self.size = 0  # bytes used by the cached portraits
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, source: pygame.Surface, max_size: Tuple[int, int]) -> pygame.Surface:
+        """
+        Returns source scaled to fit max_size, keeping its aspect ratio.
+        """
+        key = (id(source), tuple(max_size))
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return entry[1]
+        self.misses += 1
+        size = utils.resize_keep_ratio(source.get_size(), max_size)
+        scaled = pygame.transform.smoothscale(source, size)
+        # the source is kept with the portrait so that its id can't be reused while cached
+        self.cache[key] = (source, scaled)
+        self.size += self.bytes(scaled)
+        while self.size > self.capacity and len(self.cache) > 1:
+            _, (_, evicted) = self.cache.popitem(last=False)
+            self.size -= self.bytes(evicted)
+            self.evictions += 1
+        return scaled
+
+    @staticmethod
+    def bytes(surface: pygame.Surface) -> int:
+        return surface.get_bytesize() * surface.get_width() * surface.get_height()
+
+    def clear(self) -> None:
+        self.cache.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'portraits': len(self.cache),
+            'bytes': self.size,
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+        }
+
+
+portraits = PortraitCache()
+_frames: Dict[Tuple[Tuple[int, ...], Tuple[int, int]], pygame.Surface] = {}  # (team color, size) -> team circle
+
+
+def get_frame(color, size: Tuple[int, int]) -> pygame.Surface:
+    """
+    Returns the team circle drawn around the portraits of the units of a sprite of size.
+    """
+    key = (tuple(color), tuple(size))
+    frame = _frames.get(key)
+    if frame is None:
+        w, h = size
+        mh2 = (h - HP_BAR_HEIGHT) // 2
+        frame = _frames[key] = pygame.Surface(size, pygame.SRCALPHA)
+        pygame.draw.circle(frame, color, (w // 2, mh2), mh2, 3)
+    return frame
+
+
 class UnitSprite(pygame.sprite.Sprite):
     """
     Encapsulates a Unit so that it can be shown on screen as a sprite.
+
+    The image is composited from the team circle and the portrait, both shared with the other sprites (see get_frame
+    and PortraitCache), and the HP bar. When only the health changed just the strip of the HP bar is drawn again.
     """
     def __init__(self, tilemap, unit, team, *groups):
         """
@@ -28,6 +119,10 @@ class UnitSprite(pygame.sprite.Sprite):
         self.unit = unit
         self.team = team
         self.zoom = -1
+        self.dirty = 0
+        self.image = None
+        self.layers_key = None  # what the circle and the portrait currently on self.image were drawn from
+        self.health = None  # the health currently shown by the HP bar
 
         self.update()
 
@@ -57,7 +152,9 @@ class UnitSprite(pygame.sprite.Sprite):
     def zoom_changed(self):
         size = self.tilemap.zoom_tile_size
         pos = self.tilemap.pixel_at(*self.unit.coord, False)
-        self.image = pygame.Surface(size).convert_alpha()
+        if self.image is None or self.image.get_size() != tuple(size):
+            self.image = pygame.Surface(size, pygame.SRCALPHA)
+            self.layers_key = None
         self.rect = pygame.Rect(pos, size)
         self.zoom = self.tilemap.zoom
 
@@ -67,29 +164,42 @@ class UnitSprite(pygame.sprite.Sprite):
         elif not self.unit.was_modified():
             return
 
+        layers_key = (id(self.unit.image), tuple(self.unit.team.color))
+        if layers_key == self.layers_key and self.unit.health == self.health:
+            return
+
         logging.debug("Sprite update: %s" % self.unit.name)
 
+        if layers_key == self.layers_key:
+            self.compose(self.bar_rect())
+        else:
+            self.compose()
+            self.layers_key = layers_key
+        self.health = self.unit.health
+
+        self.dirty = 1  # drawn in place: see tmx.SpriteLayer.changed
+
+    def bar_rect(self) -> pygame.Rect:
         w, h = self.rect.size
-        mw, mh = img_max_size = (w, h - 5)
-        mw2, mh2 = mw // 2, mh // 2
+        return pygame.Rect(0, h - HP_BAR_HEIGHT, w, HP_BAR_HEIGHT)
 
+    def compose(self, area=None):
+        """
+        Draws the layers of the sprite on self.image, only within area if given.
+        """
+        w, h = self.rect.size
+        self.image.set_clip(area)
         self.image.fill((0, 0, 0, 0))
-        pygame.draw.circle(self.image, self.unit.team.color, (mw2, mh2), mh2, 3)
+        self.image.blit(get_frame(self.unit.team.color, (w, h)), (0, 0))
 
         src_img = self.unit.image
-        if src_img is None:
-            self.image.blit(src_img, utils.center(self.image.get_rect(), src_img.get_rect()))
-        else:
-            image_size = utils.resize_keep_ratio(src_img.get_size(), img_max_size)
-            resized_image = pygame.transform.smoothscale(src_img, image_size).convert_alpha()
-            self.image.blit(resized_image, utils.center(self.image.get_rect(), resized_image.get_rect()))
+        if src_img is not None:
+            portrait = portraits.get(src_img, (w, h - HP_BAR_HEIGHT))
+            self.image.blit(portrait, utils.center(self.image.get_rect(), portrait.get_rect()))
 
-        hp_bar_length = int(self.unit.health / self.unit.health_max * self.rect.w)
-        hp_bar = pygame.Surface((hp_bar_length, 5))
-        hp_bar.fill((0, 255, 0))
-        self.image.blit(hp_bar, (0, self.rect.h - 5))
+        hp_bar_length = int(self.unit.health / self.unit.health_max * w)
+        self.image.fill((0, 255, 0), (0, h - HP_BAR_HEIGHT, hp_bar_length, HP_BAR_HEIGHT))
 
         if self.team.is_boss(self.unit):
-            icon = pygame.Surface((3, 3))
-            icon.fill(c.BLUE)
-            self.image.blit(icon, (0, self.rect.h - 4))
+            self.image.fill(c.BLUE, (0, h - 4, 3, 3))
+        self.image.set_clip(None)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Plays many headless matches in parallel to measure how balanced a map is.
+
+Every seed is an independent match played by headless.play_match on a process pool. Results are streamed to a JSONL
+or CSV file as they come and the win rate of every team is printed with its 95% Wilson confidence interval:
+
+    python3 montecarlo.py default.tmx --seeds 0:1000 --workers 8 --output results.jsonl
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import headless
+import resources
+
+
+def wilson_interval(successes: int, trials: int, z: float = 1.96) -> Tuple[float, float]:
+    """
+    Returns the Wilson score interval of a binomial proportion (95% with the default z).
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    half = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def play(map_path: str, seed: int, max_turns: int) -> Dict[str, Any]:
+    # runs in the worker processes
+    return headless.play_match(map_path, seed=seed, max_turns=max_turns).as_dict()
+
+
+class ResultWriter(object):
+    """
+    Writes one row per match to a .jsonl or .csv file, flushing after every row.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.file = open(path, 'w', newline='') if path else None
+        self.csv = path is not None and path.endswith('.csv')
+        self.writer = None
+
+    def write(self, result: Dict[str, Any]) -> None:
+        if self.file is None:
+            return
+        if self.csv:
+            row = {k: v for k, v in result.items() if k != 'damage'}
+            row.update(('damage_' + team, damage) for team, damage in result['damage'].items())
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.file, fieldnames=list(row))
+                self.writer.writeheader()
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(result) + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+
+def run(map_path: str, seeds: Iterable[int], workers: int = os.cpu_count(), output: Optional[str] = None,
+        max_turns: int = 200) -> Dict[str, Any]:
+    """
+    Plays a match for each seed on workers processes and returns the aggregate statistics.
+    """
+    seeds = list(seeds)
+    wins: Dict[Optional[str], int] = {}
+    damage: Dict[str, int] = {}
+    turns = 0
+    writer = ResultWriter(output)
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=headless.initialize) as executor:
+            futures = [executor.submit(play, str(map_path), seed, max_turns) for seed in seeds]
+            for future in as_completed(futures):
+                result = future.result()
+                writer.write(result)
+                wins[result['winner']] = wins.get(result['winner'], 0) + 1
+                for team, dealt in result['damage'].items():
+                    damage[team] = damage.get(team, 0) + dealt
+                turns += result['turns']
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    matches = len(seeds)
+    return {
+        'matches': matches,
+        'time': elapsed,
+        'matches_per_second': matches / elapsed if elapsed else 0.0,
+        'mean_turns': turns / matches if matches else 0.0,
+        'win_rates': {team: (n / matches,) + wilson_interval(n, matches) for team, n in wins.items()},
+        'mean_damage': {team: dealt / matches for team, dealt in damage.items()},
+    }
+
+
+def report(stats: Dict[str, Any]) -> str:
+    lines = ["%d matches in %.1f s (%.1f matches/s), %.1f turns on average" %
+             (stats['matches'], stats['time'], stats['matches_per_second'], stats['mean_turns'])]
+    for team, (rate, low, high) in sorted(stats['win_rates'].items(), key=lambda item: -item[1][0]):
+        lines.append("  %-20s wins %5.1f%%  [%5.1f%%, %5.1f%%]" %
+                     (team if team else 'nobody', rate * 100, low * 100, high * 100))
+    for team, dealt in sorted(stats['mean_damage'].items()):
+        lines.append("  %-20s deals %.1f damage per match" % (team, dealt))
+    return '\n'.join(lines)
+
+
+def parse_seeds(seeds: str) -> range:
+    """
+    Parses 'start:stop' (stop excluded) or a number of seeds starting from 0.
+    """
+    if ':' in seeds:
+        start, stop = seeds.split(':')
+        return range(int(start), int(stop))
+    return range(int(seeds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play headless matches in parallel and report the win rates")
+    parser.add_argument('map', help="map file name, e.g. default.tmx")
+    parser.add_argument('-s', '--seeds', default='0:100', help="seed range start:stop or number of seeds")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('-o', '--output', default=None, help="per-match results (.jsonl or .csv)")
+    parser.add_argument('-t', '--max-turns', type=int, default=200, help="turns before a match is a draw")
+    args = parser.parse_args()
+
+    print(report(run(resources.map_path(args.map), parse_seeds(args.seeds), args.workers, args.output,
+                     args.max_turns)))
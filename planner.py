@@ -0,0 +1,203 @@
+"""
+Plans the turn of an AI team on a worker thread, while the animations of the actions already planned play.
+
+When the turn begins, Planner takes a Snapshot of the map and lets the team decide for all its units on it, one
+after the other, moving the copies of the units as it goes. Every decision is queued as soon as it is made and
+AITurn executes it when the animations of the previous one are over. A battle is assumed to leave everything as it
+is: if someone dies, or a unit that a later decision attacks is hurt or breaks its weapon, the rest of the turn is
+planned again from the real map.
+
+Planning gets AI.budget tiles of pathfinding per turn. Once they are spent the remaining units are decided in a hurry
+(see AI.decide), so a plan is always complete, if not always the best one, and the same on any machine.
+"""
+
+import copy
+import logging
+import queue
+import random
+import threading
+import time
+
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import action
+import state as s
+
+from ai import World
+from map.influence import InfluenceMap
+from map.pathfinder import Pathfinder
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    The thread plans are made on. One is enough: only one team plays at a time.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='planner')
+    return _executor
+
+
+class Snapshot(World):
+    """
+    A copy of the loaded map where every unit is a shallow copy of the real one, so that plans can move units around
+    while the real ones are being animated.
+    """
+
+    def __init__(self, team):
+        _map = s.loaded_map
+        self.copies: Dict = {unit: copy.copy(unit) for unit in _map.grid.units if unit is not None}
+        self.real: Dict = {dup: unit for unit, dup in self.copies.items()}
+        grid = _map.grid.snapshot(self.copies)
+        path = Pathfinder(grid)
+        units = [self.copies[unit] for unit in team.units if unit in self.copies]
+        enemies = [self.copies[unit] for unit in s.units_manager.get_enemies(team) if unit in self.copies]
+        super().__init__(grid, path, InfluenceMap(grid, path), units, enemies)
+
+    def move(self, unit, where) -> None:
+        source = unit.coord
+        if source != where:
+            self.grid.move(unit, source, where)
+            unit.coord = where
+            self.influence.moved(unit, source, where)
+
+    def to_real(self, _action: action.Action) -> action.Action:
+        """
+        Translates an action planned on the copies into the same action on the real units.
+        """
+        if isinstance(_action, action.Attack):
+            return action.Attack(self.real[_action.attacking], self.real[_action.defending])
+        if isinstance(_action, action.Move):
+            return action.Move(self.real[_action.who], _action.where)
+        raise NotImplementedError(f"Action {type(_action)} not implemented!")
+
+
+class Planner(object):
+    """
+    Plans the turn of team in the background and hands out its actions one at a time.
+    """
+
+    def __init__(self, team, budget: Optional[float] = None):
+        """
+        :param team: the :class:`ai.AI` team to plan for
+        :param budget: tiles the pathfinder may settle per turn, AI.budget by default
+        """
+        self.logger = logging.getLogger('Planner')
+        self.team = team
+        self.budget = team.budget if budget is None else budget
+        self.queue = queue.Queue()  # (generation, real unit, actions); unit is None at the end of a plan
+        self.generation = 0  # plans made so far; decisions of the older ones are discarded
+        self.lock = threading.Lock()  # guards generation and targets, shared with the planning thread
+        self.targets = Counter()  # real unit -> attacks on it decided but not handed out yet
+        self.future = None  # the plan being made
+        self.before = None  # state of the defender of the battle being played, before it
+        self.pending = deque()  # actions of the current unit yet to be handed out
+        self.current = None  # unit whose actions are being handed out
+        self.started = set()  # units whose actions were handed out
+        self.replans = 0
+
+    def start(self) -> None:
+        random.shuffle(self.team.units)
+        self.__plan(list(self.team.units))
+
+    def __plan(self, units: List) -> None:
+        with self.lock:
+            self.generation += 1
+            self.targets.clear()
+        self.pending.clear()
+        snapshot = Snapshot(self.team)
+        self.future = get_executor().submit(self.__think, self.generation, snapshot,
+                                            [snapshot.copies[unit] for unit in units])
+
+    def __think(self, generation: int, snapshot: Snapshot, units: List) -> None:
+        start = time.perf_counter()
+        try:
+            for unit in units:
+                if generation != self.generation:
+                    self.logger.debug("Plan %d superseded", generation)
+                    return
+                hurried = snapshot.path.expanded > self.budget
+                actions = self.team.decide(snapshot, unit, hurried)
+                for _action in actions:
+                    if isinstance(_action, action.Move):
+                        snapshot.move(_action.who, _action.where)
+                actions = [snapshot.to_real(a) for a in actions]
+                with self.lock:
+                    if generation == self.generation:
+                        self.targets.update(a.defending for a in actions if isinstance(a, action.Attack))
+                self.queue.put((generation, snapshot.real[unit], actions))
+        except Exception as e:
+            self.queue.put((generation, None, e))  # raised by next_action
+            return
+        self.queue.put((generation, None, None))
+        self.logger.info("Plan %d made in %.1f ms", generation, (time.perf_counter() - start) * 1000)
+
+    def next_action(self) -> Optional[action.Action]:
+        """
+        Returns the next action of the plan or None if it isn't ready yet.
+        :raise: StopIteration when there is nothing left to do this turn, or the exception planning failed with
+        """
+        while not self.pending:
+            if self.current is not None and not self.current.played:
+                self.current.played = True  # it only moved, or waited
+            self.current = None
+            if s.winner is not None:
+                raise StopIteration
+            try:
+                generation, unit, actions = self.queue.get_nowait()
+            except queue.Empty:
+                return None
+            if generation != self.generation:
+                continue
+            if unit is None:
+                if actions is not None:
+                    raise actions
+                raise StopIteration
+            if unit not in self.team.units:
+                continue  # died
+            self.current = unit
+            self.started.add(unit)
+            self.pending.extend(actions)
+        _action = self.pending.popleft()
+        if isinstance(_action, action.Attack):
+            with self.lock:
+                self.targets[_action.defending] -= 1
+            self.before = self.state(_action.defending)
+        return _action
+
+    @staticmethod
+    def state(unit):
+        """
+        What a decision assumes about unit: its health and whether its weapon still works.
+        """
+        return unit.health, unit.weapon is not None and unit.weapon.uses > 0
+
+    def resolved(self, attack: action.Attack) -> None:
+        """
+        Called when the battle of attack is over. Plans the rest of the turn again if it changed who is alive, or if
+        it hurt the defender or broke its weapon while a later decision attacks it or the plan isn't finished yet.
+        """
+        defending = attack.defending
+        if attack.attacking.health <= 0 or defending.health <= 0:
+            reason = "%s died" % (defending if defending.health <= 0 else attack.attacking)
+        elif self.state(defending) != self.before:
+            with self.lock:
+                targeted = self.targets[defending] > 0
+            if targeted:
+                reason = "%s will be attacked again" % defending
+            elif not self.future.done():
+                reason = "%s changed while planning" % defending
+            else:
+                return
+        else:
+            return
+        remaining = [unit for unit in self.team.units if unit not in self.started]
+        if remaining and s.winner is None:
+            self.replans += 1
+            self.logger.debug("%s: planning again for %d units", reason, len(remaining))
+            self.__plan(remaining)
@@ -0,0 +1,143 @@
+"""
+Loads the assets on a worker thread while the splash screen and the menus wait for the player, so that choosing a map
+doesn't stall on disk reads and decoding.
+
+The worker only does what doesn't need the display: it decodes images, sprites and sounds, parses the YAML data and
+compiles the maps with their tileset images into the caches that resources, utils, sounds and tmx consult before
+loading anything.
+Converting a Surface to the display format only works on the main thread, so it is left to the first use (see
+resources.get_sprite and tmx.Tileset.add_image).
+"""
+
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import resources
+import sounds
+import tmx
+import utils
+
+
+IMAGES = ['saber.png', 'WindowBorder.png', 'old-paper.jpg', 'cursor.png', 'arrow.png', 'GNU GPL.jpg',
+          'gigachad.jpg']  #: images of the menus and the maps
+
+_executor: Optional[ThreadPoolExecutor] = None
+_preloader: Optional['Preloader'] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    The thread assets are preloaded on.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preloader')
+    return _executor
+
+
+class Preloader(object):
+    """
+    Runs a list of loading tasks one after the other on the worker thread and tells how far it got.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('Preloader')
+        self.tasks: List[Tuple[str, Callable, tuple]] = []  # (description, function, arguments)
+        self.done = 0  # tasks completed or failed
+        self.cancelled = threading.Event()
+        self.future = None
+        self.time = 0.0  # seconds spent loading
+
+    def add(self, description: str, function: Callable, *args) -> None:
+        self.tasks.append((description, function, args))
+
+    def add_defaults(self) -> None:
+        """
+        Queues what the menus and the first map load need: images, unit data and sprites, sounds and the maps.
+        """
+        for image in IMAGES:
+            self.add(image, resources.load_image, image)
+        for data in ('units.yml', 'weapons.yml'):
+            self.add(data, utils.load_yaml, resources.DATA_PATH / data)
+        for path in sorted(set(resources.sprites_index().values())):
+            if path.suffix in ('.png', '.jpg'):
+                self.add(path.name, resources.decode_sprite, path.name)
+        for sound in sounds.WARM_UP:
+            self.add(sound, sounds.warm_up, [sound])
+        self.add('maps index', resources.list_maps)
+        for file in sorted(resources.MAPS_PATH.iterdir()):
+            if resources.is_map(file):
+                self.add(file.name, tmx.preload, str(file), str(resources.CACHE_PATH))
+
+    def start(self) -> None:
+        self.future = get_executor().submit(self.__run)
+
+    def __run(self) -> None:
+        start = time.perf_counter()
+        for description, function, args in self.tasks:
+            if self.cancelled.is_set():
+                self.logger.info("Cancelled after %d of %d tasks", self.done, len(self.tasks))
+                break
+            try:
+                function(*args)
+            except Exception as e:
+                # it will fail again when it is loaded, where the error can be shown
+                self.logger.warning("Couldn't preload %s: %s", description, e)
+            self.done += 1
+        self.time = time.perf_counter() - start
+        self.logger.info("Preloaded %d assets in %.0f ms", self.done, self.time * 1000)
+
+    @property
+    def progress(self) -> float:
+        """
+        The fraction of the tasks done, from 0 to 1.
+        """
+        return self.done / len(self.tasks) if self.tasks else 1.0
+
+    @property
+    def finished(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def cancel(self) -> None:
+        """
+        Skips the tasks not started yet, e.g. because the player chose what to load before they were needed.
+        """
+        self.cancelled.set()
+
+
+def start() -> Preloader:
+    """
+    Starts preloading the default assets. Call it after display.initialize.
+    """
+    global _preloader
+    if _preloader is None:
+        _preloader = Preloader()
+        _preloader.add_defaults()
+        _preloader.start()
+    return _preloader
+
+
+def get() -> Optional[Preloader]:
+    """
+    Returns the running Preloader, if any.
+    """
+    return _preloader
+
+
+def cancel() -> None:
+    if _preloader is not None:
+        _preloader.cancel()
+
+
+def shutdown() -> None:
+    """
+    Stops preloading for good, so that quitting the game doesn't wait for the tasks left: only the one being run is
+    finished.
+    """
+    cancel()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
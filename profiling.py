@@ -0,0 +1,82 @@
+"""
+Startup time report printed by main.py --profile-startup.
+
+StartupProfiler wraps builtins.__import__ to time every module imported for the first time by the main thread,
+distinguishing the time spent in the module itself from the time spent importing its dependencies, and records the
+duration of named initialization steps.
+"""
+
+import builtins
+import importlib.util
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+
+class StartupProfiler(object):
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.imports: Dict[str, List[float]] = {}  # module -> [cumulative seconds, self seconds]
+        self.steps: List[Tuple[str, float]] = []
+        self.stack: List[float] = []  # time spent in the nested imports of the imports in progress
+        self.thread = threading.get_ident()
+        self.original_import = builtins.__import__
+
+    def install(self) -> None:
+        builtins.__import__ = self.__import
+
+    def uninstall(self) -> None:
+        builtins.__import__ = self.original_import
+
+    def __import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = name
+        if level:
+            try:
+                module = importlib.util.resolve_name('.' * level + name, (globals or {}).get('__package__'))
+            except (ImportError, ValueError):
+                pass
+        if module in sys.modules or threading.get_ident() != self.thread:
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        self.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            times = self.imports.setdefault(module, [0.0, 0.0])
+            times[0] += elapsed
+            times[1] += elapsed - children
+
+    @contextmanager
+    def step(self, name: str):
+        """
+        Times the body of a with statement as an initialization step.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_step(name, time.perf_counter() - start)
+
+    def add_step(self, name: str, seconds: float) -> None:
+        self.steps.append((name, seconds))
+
+    def report(self, top: int = 20) -> str:
+        total = time.perf_counter() - self.start
+        lines = ["Startup took %.0f ms" % (total * 1000), "", "Steps (ms):"]
+        for name, seconds in self.steps:
+            lines.append("  %8.1f  %s" % (seconds * 1000, name))
+        lines += ["", "Slowest imports (self ms, cumulative ms):"]
+        ranking = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        for module, (cumulative, own) in ranking[:top]:
+            lines.append("  %8.1f  %8.1f  %s" % (own * 1000, cumulative * 1000, module))
+        own_total = sum(own for _, own in self.imports.values())
+        lines.append("  %8.1f  in %d modules" % (own_total * 1000, len(self.imports)))
+        return '\n'.join(lines)
@@ -1,93 +1,38 @@
-from qiskit import *
+"""
+Quantum entanglement between units.
+
+Every entanglement prepares a Bell pair and measures it: if both correlated outcomes show up, the units swap the
+entangled attribute. The circuit is run on a pluggable backend: the built-in exact statevector simulator (local) or
+IonQ's simulator through Azure Quantum (azure). Choose one with set_backend before the first measurement.
+"""
+
+import logging
+import threading
+import time
+
+import numpy as np
+import pygame
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum, auto
+from typing import Dict, List, Optional, Sequence, Tuple
+
 import unit
 import gui
 import room
+import events
 import fonts as f
-from azure.quantum.qiskit import AzureQuantumProvider
-from qiskit.tools.monitor import job_monitor
-from qiskit.visualization import plot_histogram
-from qiskit import QuantumCircuit, Aer, execute
-from qiskit.visualization import plot_histogram
 
 
 resource_id = "/subscriptions/b1d7f7f8-743f-458e-b3a0-3e09734d716d/resourceGroups/aq-hackathons/providers/Microsoft.Quantum/Workspaces/aq-hackathon-01"
 
-provider = AzureQuantumProvider(
-    resource_id=resource_id,
-    location= "East US"
-)
 all_pairs = ['00','01','10','11']
-class Quantum():
-    #backend = provider.get_backend("ionq.simulator")
-    def __init__(self, parent, child, attribute):
-        self.parent: unit.Unit = parent
-        self.child: unit.Unit = child
-        self.attribute: str = attribute
-
-        # prepare the quantum circuit
-        # this is only for entanglement (I think?)
-        q = QuantumRegister(2, "q")  # quantum register with 2 qubits
-        c = ClassicalRegister(2, "c")  # classical register with 2 bits
-        self.qc = QuantumCircuit(q, c)  # quantum circuit with quantum and classical registers
-
-        # prepare the quantum circuit
-        # this is only for entanglement (I think?)
-        self.qc.h(q[0])
-        self.qc.cx(q[0], q[1])
-        self.qc.barrier()
-        self.qc.measure(q, c)
-        # job = backend.run(qc, shots=100)
-        # job_monitor(job)
-
-    def run_job(self):
-        backend = provider.get_backend("ionq.simulator")
-        job = backend.run(self.qc, shots=10)
-        job_monitor(job)
-        return job
-
-    def measure(self):  # I think this needs to get multithreaded to avoid conflict with GUI
-        # return True
-        job = self.run_job()
-        result = job.result()
-        counts = result.get_counts(self.qc)
-        print(result)
-        print(counts)
-        entangled_states = counts.keys()
-        if ('00' in entangled_states and '11' in entangled_states):
-            return True
-        else:
-            return False
-
-
-
-    def observe(self):
-        if self.measure():
-            modal = gui.Dialog(f"SWITCHAROO!!! Switched stat {self.attribute}",
-                              f.MAIN, layout=room.Layout(gravity=gui.Gravity.CENTER), dismiss_callback=True,
-                              clear_screen=None)
-            room.run_room(modal)
-            print(f"SWITCHAROO!!! Switched stat {self.attribute}")
-            tmp = getattr(self.parent, self.attribute)
-            setattr(self.parent, self.attribute, getattr(self.child, self.attribute))
-            setattr(self.child, self.attribute, tmp)
-        
 
-    def edit_circuit(): # allow player to manipulate circuit themselves if there's time
-        pass
+SHOTS = 10
 
-'''
-Work in progress: Alternate code for quantum.py file with additional changes
+# Posted from the executor when a job finishes. event.quantum is the Quantum that was measured.
+MEASURED = events.new_event_type()
 
-#from qiskit import *
-import unit
-import gui
-import room
-import fonts as f
-
-from typing import Optional, Tuple
-from enum import Enum, auto
-
-Coord = Tuple[int, int]
 
 #certainly not the most elegant enum I've ever written...
 class Attributes(Enum):
@@ -109,70 +54,368 @@ class Attributes(Enum):
     position = auto()
 
 
-# can only entangle weapons if max wrank of unit >= min rank of weapon (who cares though w)
+class Circuit(object):
+    """
+    Backend independent description of a circuit: a list of gates applied to num_qubits qubits, all of which are
+    measured at the end.
+
+    Gates are tuples like ('h', 0) or ('cx', 0, 1).
+    """
+
+    def __init__(self, num_qubits: int):
+        self.num_qubits = num_qubits
+        self.gates: List[Tuple] = []
+
+    def h(self, qubit: int) -> None:
+        self.gates.append(('h', qubit))
+
+    def cx(self, control: int, target: int) -> None:
+        self.gates.append(('cx', control, target))
+
+    def append(self, other: 'Circuit', offset: int) -> None:
+        """
+        Appends the gates of other shifted onto the qubits starting at offset.
+        """
+        for gate in other.gates:
+            self.gates.append((gate[0],) + tuple(q + offset for q in gate[1:]))
+
+
+def bell_pair() -> Circuit:
+    circuit = Circuit(2)
+    circuit.h(0)
+    circuit.cx(0, 1)
+    return circuit
+
+
+class Backend(object):
+    """
+    Runs circuits. run returns the counts of the measured bit strings, e.g. {'00': 6, '11': 4}, with qubit 0 as the
+    rightmost bit like qiskit does.
+    """
+    name = None
+    max_qubits = 2
+
+    def run(self, circuit: Circuit, shots: int = SHOTS) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def run_many(self, circuits: Sequence[Circuit], shots: int = SHOTS) -> List[Dict[str, int]]:
+        return [self.run(circuit, shots) for circuit in circuits]
+
+    def warm_up(self) -> None:
+        """
+        Does whatever is slow about the first run, so that it can be done ahead of time.
+        """
+        self.run(bell_pair(), 1)
+
+
+class LocalBackend(Backend):
+    """
+    Exact statevector simulator: applies the gates to the full state and samples the measurements from the final
+    amplitudes.
+    """
+    name = 'local'
+    max_qubits = 16  # the statevector holds 2 ** max_qubits amplitudes
+
+    H = np.array([[1, 1], [1, -1]], dtype=complex) / np.sqrt(2)
+
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()  # jobs run on the executor's threads and Generators are not thread safe
+
+    def statevector(self, circuit: Circuit) -> np.ndarray:
+        n = circuit.num_qubits
+        state = np.zeros(2 ** n, dtype=complex)
+        state[0] = 1
+        # axis n - 1 - k of the reshaped state is qubit k, so that index i still has qubit 0 as its lowest bit
+        state = state.reshape((2,) * n)
+        for gate in circuit.gates:
+            if gate[0] == 'h':
+                axis = n - 1 - gate[1]
+                state = np.moveaxis(np.tensordot(self.H, state, axes=([1], [axis])), 0, axis)
+            elif gate[0] == 'cx':
+                control, target = n - 1 - gate[1], n - 1 - gate[2]
+                index = [slice(None)] * n
+                index[control] = 1
+                index = tuple(index)
+                # the target axis shifts down by one once the control axis is fixed
+                state[index] = np.flip(state[index], axis=target - (target > control)).copy()
+            else:
+                raise ValueError("Unknown gate %r" % (gate[0],))
+        return state.reshape(-1)
+
+    def run(self, circuit: Circuit, shots: int = SHOTS) -> Dict[str, int]:
+        probabilities = np.abs(self.statevector(circuit)) ** 2
+        probabilities /= probabilities.sum()
+        with self.lock:
+            outcomes = self.rng.choice(len(probabilities), size=shots, p=probabilities)
+        counts = {}
+        for outcome, count in zip(*np.unique(outcomes, return_counts=True)):
+            counts[format(outcome, '0%db' % circuit.num_qubits)] = int(count)
+        return counts
+
+
+class AzureBackend(Backend):
+    """
+    Sends circuits to IonQ's simulator on Azure Quantum. qiskit and azure-quantum are only imported, and the
+    workspace only contacted, on the first run.
+    """
+    name = 'azure'
+    max_qubits = 28  # ionq.simulator allows 29
+
+    def __init__(self, target: str = "ionq.simulator"):
+        self.target = target
+        self.provider = None
+        self.lock = threading.Lock()  # the warm-up and the first job may race to create the provider
+
+    def get_provider(self):
+        with self.lock:
+            if self.provider is None:
+                from azure.quantum.qiskit import AzureQuantumProvider
+                self.provider = AzureQuantumProvider(
+                    resource_id=resource_id,
+                    location= "East US"
+                )
+            return self.provider
+
+    def warm_up(self) -> None:
+        # import qiskit and authenticate, but don't spend a job
+        self.to_qiskit(bell_pair())
+        self.get_provider().get_backend(self.target)
+
+    @staticmethod
+    def to_qiskit(circuit: Circuit):
+        from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+        q = QuantumRegister(circuit.num_qubits, "q")
+        c = ClassicalRegister(circuit.num_qubits, "c")
+        qc = QuantumCircuit(q, c)
+        for gate in circuit.gates:
+            getattr(qc, gate[0])(*(q[i] for i in gate[1:]))
+        qc.barrier()
+        qc.measure(q, c)
+        return qc
+
+    def run(self, circuit: Circuit, shots: int = SHOTS) -> Dict[str, int]:
+        from qiskit.tools.monitor import job_monitor
+        qc = self.to_qiskit(circuit)
+        job = self.get_provider().get_backend(self.target).run(qc, shots=shots)
+        job_monitor(job)
+        result = job.result()
+        print(result)
+        return result.get_counts(qc)
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'azure': AzureBackend,
+}
+
+_backend: Optional[Backend] = None
+
+
+def set_backend(backend) -> Backend:
+    """
+    Selects the backend used by every Quantum. backend is either a Backend instance or one of the names in BACKENDS.
+    """
+    global _backend
+    if isinstance(backend, str):
+        try:
+            backend = BACKENDS[backend]()
+        except KeyError:
+            raise ValueError("Unknown quantum backend %r: choose one of %s" % (backend, ', '.join(BACKENDS)))
+    _backend = backend
+    logging.info("Quantum backend: %s", backend.name)
+    return backend
+
+
+def get_backend() -> Backend:
+    if _backend is None:
+        set_backend('local')
+    return _backend
+
+
+# QuantumEntropyPool (see entropy.py) collapses draw their shots from instead of running a job, if set
+pool = None
+
+
+def set_entropy_pool(entropy_pool) -> None:
+    global pool
+    pool = entropy_pool
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool quantum jobs run on, so that waiting for a remote backend never blocks the room loop.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='quantum')
+    return _executor
+
+
+def warm_up() -> Future:
+    """
+    Prepares the selected backend in the background, e.g. importing qiskit and connecting to Azure, so that the
+    first entanglement doesn't have to. Returns a future holding the time it took in seconds.
+    """
+    backend = get_backend()
+
+    def run() -> float:
+        start = time.perf_counter()
+        try:
+            backend.warm_up()
+        except Exception:
+            logging.exception("Quantum backend %s warm-up failed", backend.name)
+        elapsed = time.perf_counter() - start
+        logging.info("Quantum backend %s warm-up took %.0f ms", backend.name, elapsed * 1000)
+        return elapsed
+
+    return get_executor().submit(run)
+
+
+def post_measured(quantum: 'Quantum') -> None:
+    if pygame.display.get_init():
+        pygame.event.post(pygame.event.Event(MEASURED, quantum=quantum))
+
+
+def marginal(counts: Dict[str, int], offset: int, width: int) -> Dict[str, int]:
+    """
+    Returns the counts of qubits offset to offset + width - 1 alone, out of the counts of a wider circuit.
+    """
+    result = {}
+    for bits, count in counts.items():
+        end = len(bits) - offset
+        key = bits[end - width:end]
+        result[key] = result.get(key, 0) + count
+    return result
+
+
+class Batch(object):
+    """
+    Gathers the Quantum events created during a turn and runs them as a single job: the pairs are laid on disjoint
+    qubits of as few wide circuits as the backend allows, and the counts of every pair are recovered as marginals.
+
+    UnitsManager.switch_turn flushes the batch; Quantum.measure flushes it early if a collapse can't wait.
+    """
+
+    def __init__(self):
+        self.pending: List['Quantum'] = []
+        self.jobs = 0
+        self.circuits = 0
+        self.events = 0
+
+    def add(self, event: 'Quantum') -> None:
+        if event not in self.pending:
+            self.pending.append(event)
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        backend = get_backend()
+
+        circuits, layout = [], []  # layout: (event, circuit index, offset)
+        for event in pending:
+            width = event.qc.num_qubits
+            if not circuits or circuits[-1].num_qubits + width > backend.max_qubits:
+                circuits.append(Circuit(0))
+            circuit = circuits[-1]
+            layout.append((event, len(circuits) - 1, circuit.num_qubits))
+            circuit.append(event.qc, circuit.num_qubits)
+            circuit.num_qubits += width
+            event.future = Future()
+
+        def demultiplex(job: Future) -> None:
+            for event, i, offset in layout:
+                if job.exception() is not None:
+                    event.future.set_exception(job.exception())
+                else:
+                    event.future.set_result(marginal(job.result()[i], offset, event.qc.num_qubits))
+                post_measured(event)
+
+        self.jobs += 1
+        self.circuits += len(circuits)
+        self.events += len(pending)
+        logging.debug("Quantum batch: %d entanglements on %d circuits", len(pending), len(circuits))
+        get_executor().submit(backend.run_many, circuits, SHOTS).add_done_callback(demultiplex)
+
+
+batch = Batch()
+
 
 class Quantum():
-    #backend = provider.get_backend("ionq.simulator")
     def __init__(self, parent, child, attribute):
         self.parent: unit.Unit = parent
         self.child: unit.Unit = child
         self.attribute: Attributes = attribute
-        self.result: Tuple[bool, int] = (False, None) # this doesn't necessarily have to be an int, but might as well be
+        self.future: Optional[Future] = None
 
         # prepare the quantum circuit
         # this is only for entanglement (I think?)
-        #qreg = QuantumRegister(1)
-        #creg = ClassicalRegister(1)
-        #self.circ = QuantumCircuit(qreg, creg)
-        #circ.h(qreg[0])
-        #circ.measure(qreg, creg)
-
-    # call this after qubits are superimposed to offload the expensive call to azure. Won't actually affect game state until observe() is called.
-                       # v check this please. Game is supposed to hang, but add a scroll wheel or something to prevent failure of other key functions. Maybe you can even use async or something
-    def measure(self): # I think this needs to get multithreaded to avoid conflict with GUI
-        if not self.result[0]:
-            # compute result
-            answer = 1
-            self.result = (True, answer)
-        return self.result[1]
-        #result = self.backend.run(self.circ, shots=1).result()
-        #counts = result.get_counts(circ)
-        #return counts.keys()[0] == "1"
+        self.qc = bell_pair()
+
+    def submit(self) -> None:
+        """
+        Queues the circuit on the current turn's batch. A MEASURED event is posted when its counts are ready.
+        """
+        if self.future is None and pool is None:
+            batch.add(self)
+
+    def ready(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def measure(self):
+        if pool is not None and self.future is None:
+            counts = pool.bell_counts(SHOTS)
+            print(counts)
+            return '00' in counts and '11' in counts
+        if self.future is None:
+            self.submit()
+            batch.flush()
+        future = self.future
+        if not future.done():
+            import rooms
+            room.run_room(rooms.MeasurementWait(self))
+        counts = future.result()
+        print(counts)
+        entangled_states = counts.keys()
+        if ('00' in entangled_states and '11' in entangled_states):
+            return True
+        else:
+            return False
+
+    def swapped_attributes(self) -> Sequence[str]:
+        if self.attribute is Attributes.position:
+            # coords are the weird ones: TileMap.attack swaps the units once collapse returns their coords
+            return ()
+        elif self.attribute is Attributes.health:
+            return ["health", "health_max", "health_prev"]
+        elif self.attribute is Attributes.level:
+            return ["level", "level_prev", "experience", "exp_prev"]
+        else:
+            return [self.attribute.name]
 
     def observe(self) -> bool:
+        """
+        Measures the pair and swaps the attribute if needed. Returns whether the units have to swap position.
+        """
         if self.measure():
-            # this may not work on your machine (python 10 feature), so ig you can change to if-elif as needed
-            attr_list = []
-            moving = False
-            match self.attribute:
-                case Attributes.position:
-                    # coords are the weird ones. Try TileMap.move_unit() and sprite.reposition()
-                    # I'm going to take care of this logic within map.py because it's simply easier. Who cares about project structure, amirite?
-                    moving = True
-                    pass
-                case Attributes.health:
-                    attr_list = ["health", "health_max", "health_prev"]
-                case Attributes.level:
-                    attr_list = ["level", "level_prev", "experience", "exp_prev"]
-                case _:
-                    attr_list = [str(self.attribute.name)]
-
-            for attr in attr_list:
-                tmp = getattr(self.parent, attr)
+            for attr in self.swapped_attributes():
                 # just... don't switch attributes like image. Don't do it!
-                setattr(self.parent, attr, getattr(self.child, self.attribute))
+                tmp = getattr(self.parent, attr)
+                setattr(self.parent, attr, getattr(self.child, attr))
                 setattr(self.child, attr, tmp)
 
-
             modal = gui.Dialog(f"SWITCHAROO!!! Switched stat {self.attribute.name}",
                               f.MAIN, layout=room.Layout(gravity=gui.Gravity.CENTER), dismiss_callback=True,
                               clear_screen=None)
             room.run_room(modal)
-            print(f"SWITCHAROO!!! Switched stat {self.attribute}")
+            print(f"SWITCHAROO!!! Switched stat {self.attribute.name}")
 
-            return moving
-        
+            return self.attribute is Attributes.position
+        return False
 
     def edit_circuit(): # allow player to manipulate circuit themselves if there's time
         pass
-'''
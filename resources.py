@@ -1,14 +1,19 @@
 """
 Resources are cool. Contains a map of Ice Emblem file system and provides access to resources.
 """
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import pygame
 import logging
+import json
+import os
+import threading
 
 from pathlib import Path
 from xml.etree import ElementTree
 
+import utils
+
 
 if not pygame.font.get_init():
     pygame.font.init()
@@ -22,18 +27,32 @@ LOCALE_PATH =  RESOURCES_PATH / 'locale'
 MAPS_PATH =    RESOURCES_PATH / 'maps'
 SPRITES_PATH = RESOURCES_PATH / 'sprites'
 DATA_PATH =    RESOURCES_PATH / 'data'
+CACHE_PATH =   Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'ice-emblem'  #: compiled maps
+MAPS_INDEX_PATH = CACHE_PATH / 'maps.json'  #: names of the maps, see list_maps
 
 __logger = logging.getLogger(__name__)
 
+_sprites_index: Optional[Dict[str, Path]] = None  # sprite name, with and without extension -> path
+_sprites: Dict[Tuple[str, Optional[Tuple[int, int]]], pygame.Surface] = {}  # (name, max size) -> shared image
+_sprites_stats = {'decodes': 0, 'hits': 0, 'bytes': 0, 'preloaded': 0}
+_decoded_sprites: Dict[Path, pygame.Surface] = {}  # sprites decoded in advance, see decode_sprite
+_images: Dict[str, pygame.Surface] = {}  # see load_image
+
 
 def __load_log(path):
     __logger.debug('Loading %s', path)
 
 
 def load_image(fname):
-    path = str(IMAGE_PATH / fname)
-    __load_log(path)
-    return pygame.image.load(path)
+    """
+    Returns an image of the images directory. Images are decoded once and shared: don't draw on them.
+    """
+    image = _images.get(fname)
+    if image is None:
+        path = str(IMAGE_PATH / fname)
+        __load_log(path)
+        image = _images.setdefault(fname, pygame.image.load(path))
+    return image
 
 
 def load_sound(fname):
@@ -82,6 +101,21 @@ def is_map(fname):
     return path.is_file() and path.suffix == '.tmx'
 
 
+def sprites_index() -> Dict[str, Path]:
+    """
+    Returns the sprites by name, with and without file extension. The sprites directory is scanned only once.
+    """
+    global _sprites_index
+    if _sprites_index is None:
+        index = {}
+        for f in sorted(SPRITES_PATH.iterdir()):
+            index[f.name] = f
+            if f.suffix in ('.png', '.jpg'):
+                index.setdefault(f.stem, f)
+        _sprites_index = index
+    return _sprites_index
+
+
 def sprite_path(name: str):
     """
     Return the path to a sprite by filename with or without file extension.
@@ -89,12 +123,65 @@ def sprite_path(name: str):
     :param name: The name of the sprite. Doesn't need file extension. png and jpg files are supported.
     :return: the absolute path to a sprite resource.
     """
-    if '.' not in name:
-        for f in SPRITES_PATH.iterdir():
-            if f.name == name + '.png' or f.name == name + '.jpg':
-                name = f.name
-                break
-    return SPRITES_PATH / name
+    return sprites_index().get(name, SPRITES_PATH / name)
+
+
+def get_sprite(name: str, max_size: Optional[Tuple[int, int]] = None) -> pygame.Surface:
+    """
+    Returns a sprite converted for fast blitting and scaled to fit max_size, keeping its aspect ratio. Every sprite
+    is decoded once: the same Surface is shared by all the callers, who must not draw on it.
+
+    :param name: The name of the sprite, see sprite_path.
+    :param max_size: (width, height) the sprite must fit in, None to keep its size.
+    :raise: FileNotFoundError if there is no such sprite
+    """
+    key = (name, tuple(max_size) if max_size is not None else None)
+    image = _sprites.get(key)
+    if image is not None:
+        _sprites_stats['hits'] += 1
+        return image
+    decoded = _decoded_sprites.pop(sprite_path(name), None)
+    if decoded is not None:
+        _sprites_stats['preloaded'] += 1
+    else:
+        decoded = load_sprite(name)
+    image = decoded.convert_alpha()
+    if max_size is not None:
+        image = pygame.transform.smoothscale(image, utils.resize_keep_ratio(image.get_size(), max_size))
+    _sprites[key] = image
+    _sprites_stats['decodes'] += 1
+    _sprites_stats['bytes'] += image.get_bytesize() * image.get_width() * image.get_height()
+    return image
+
+
+def decode_sprite(name: str) -> None:
+    """
+    Decodes a sprite ahead of its first get_sprite, which only has to convert it. Unlike get_sprite it is safe to
+    call from any thread.
+    """
+    path = sprite_path(name)
+    if path not in _decoded_sprites and not any(sprite_path(key[0]) == path for key in list(_sprites)):
+        __load_log(path)
+        _decoded_sprites[path] = pygame.image.load(str(path))
+
+
+def preload(names: Iterable[str], max_size: Optional[Tuple[int, int]] = None) -> None:
+    """
+    Decodes the sprites in names ahead of their first get_sprite. Missing sprites are skipped.
+    """
+    for name in names:
+        try:
+            get_sprite(name, max_size)
+        except FileNotFoundError:
+            __logger.warning("Can't preload missing sprite %s", name)
+
+
+def sprites_stats() -> Dict[str, int]:
+    """
+    Returns how many sprites were decoded, how many of them in advance, how many requests were served from the
+    registry and the bytes they use.
+    """
+    return dict(_sprites_stats, sprites=len(_sprites))
 
 
 def list_sounds():
@@ -117,11 +204,35 @@ def get_map_name(filename):
 
 
 def list_maps() -> List[Tuple[str, str]]:
-    ls = MAPS_PATH.iterdir()
+    """
+    Returns (file name, map name) for every map. Names are read from the index at MAPS_INDEX_PATH: only the maps
+    added or changed since it was written are parsed again.
+    """
+    try:
+        with open(MAPS_INDEX_PATH) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
     maps = []
-    for file in ls:
+    changed = False
+    for file in sorted(MAPS_PATH.iterdir()):
         if is_map(file):
-            map_name = get_map_name(file)
-            if map_name is not None:
-                maps.append((file.name, map_name))
+            stat = file.stat()
+            entry = index.get(file.name)
+            if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                entry = index[file.name] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size,
+                                            'name': get_map_name(file)}
+                changed = True
+            if entry['name'] is not None:
+                maps.append((file.name, entry['name']))
+    if changed:
+        try:
+            CACHE_PATH.mkdir(parents=True, exist_ok=True)
+            # the preloader may be listing the maps at the same time, see preloader.Preloader
+            temporary = MAPS_INDEX_PATH.with_name('%s.%d.tmp' % (MAPS_INDEX_PATH.name, threading.get_ident()))
+            with open(temporary, 'w') as f:
+                json.dump(index, f)
+            os.replace(temporary, MAPS_INDEX_PATH)
+        except OSError:
+            __logger.warning("Can't write the maps index %s", MAPS_INDEX_PATH)
     return maps
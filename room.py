@@ -3,7 +3,7 @@ This module is central in Ice Emblem's engine since it provides the Room class a
 upon Room objects.
 """
 
-from typing import Callable, List, Tuple, Union, Dict
+from typing import Callable, List, Optional, Tuple, Union, Dict
 
 import pygame
 import pygame.locals as p
@@ -21,6 +21,12 @@ import utils
 from basictypes import NESW
 
 
+MAX_DIRTY_RECTS = 32  #: past this many dirty rects a room is redrawn as a whole
+
+_redraw_window = True  # the next frame must update the whole window, not only the dirty rects
+_overlays: List[pygame.Rect] = []  # window areas covered by the FPS counter and the debug overlay last frame
+
+
 class Gravity(Flag):
     """
     Standard constants and tools for placing an object within a potentially larger container.
@@ -263,6 +269,7 @@ class Room(object):
         self.done: bool = False
         self.root: bool = False
         self.valid: bool = False
+        self.dirty: Optional[List[pygame.Rect]] = None  # areas to redraw, in local coordinates; None means everything
         self.visible: bool = kwargs.get('visible', True)
 
         self.background: Background = kwargs.get('background', Background())
@@ -351,16 +358,29 @@ class Room(object):
         self.invalidate()
         self.wait_invalidate()
 
-    def invalidate(self) -> None:
+    def invalidate(self, area: Optional[pygame.Rect] = None) -> None:
         """
         Bottom-top traverse of the tree. Every parent is invalidated up until the root.
 
-        The draw method will be called at next frame if the Room is invalid.
+        The draw method will be called at next frame if the Room is invalid. Every room on the way records the
+        invalidated area in its own coordinates: parents blit again only the children intersecting it and the root
+        updates only that part of the window.
+        :param area: the part of this room that changed, relative to its top-left corner (defaults to all of it)
         """
-        self.valid = False
-        node = self.parent
-        while node and node.valid:
+        node = self
+        while node:
+            bounds = pygame.Rect((0, 0), node.rect.size)
+            if area is None:
+                node.dirty = None
+                area = bounds
+            else:
+                area = area.clip(bounds)
+                if node.dirty is not None and area.w > 0 and area.h > 0:
+                    node.dirty.append(area)
+                    if len(node.dirty) > MAX_DIRTY_RECTS:
+                        node.dirty = None
             node.valid = False
+            area = area.move(node.rect.topleft)
             node = node.parent
         self.logger.debug("Invalidated")
 
@@ -474,7 +494,11 @@ class Room(object):
         An handy method to finalize layout.
         :param rect: contains the position and size this child should use.
         """
-        self.rect.topleft = rect.topleft
+        if self.rect.topleft != rect.topleft:
+            if self.parent:
+                self.parent.invalidate(self.rect.copy())  # the area it leaves
+            self.rect.topleft = rect.topleft
+            self.invalidate()
         self.resize(rect.size)
         self.layout.valid = True
         self.logger.debug("layout gravity: %s; rect: %s", self.layout.gravity, self.rect)
@@ -486,6 +510,8 @@ class Room(object):
         :return:
         """
         if self.rect.size != size:
+            if self.parent:
+                self.parent.invalidate(self.rect.copy())
             self.rect.size = size
             if self.background.transparent:
                 self.surface: pygame.Surface = pygame.Surface(self.rect.size, flags=pygame.SRCALPHA)
@@ -548,13 +574,22 @@ class Room(object):
 
     def draw_children(self) -> None:
         """
-        Draw children recursively by calling their draw method if they are visible and invalid.
+        Draw children recursively by calling their draw method if they are visible and invalid, then blit the parts of
+        them that intersect the dirty areas of this room.
         """
+        dirty = self.dirty
         for child in self.children:
             if child.visible:
                 if not child.valid:
                     child.draw()
-                self.surface.blit(child.surface, child.rect)
+                    child.dirty = []
+                if dirty is None:
+                    self.surface.blit(child.surface, child.rect)
+                    continue
+                for area in dirty:
+                    area = area.clip(child.rect)
+                    if area.w > 0 and area.h > 0:
+                        self.surface.blit(child.surface, area, area.move(-child.rect.x, -child.rect.y))
 
     def fill(self, area=None) -> None:
         """
@@ -564,6 +599,11 @@ class Room(object):
         is pretty expensive.
         :param area: if not None restricts the fill to an area.
         """
+        # the fill wipes the children under it: draw_children has to blit them again there, not only where they changed
+        if area is None:
+            self.dirty = None
+        elif self.dirty is not None:
+            self.dirty.append(pygame.Rect(area))
         self.surface.set_clip(None)
         self.background.fill(self.surface, area)
         clip_area = self.rect.inflate(-self.padding.we, -self.padding.ns)
@@ -577,6 +617,7 @@ class Room(object):
         """
         self.fill()
         self.valid = False
+        self.dirty = None
         for child in self.children:
             child.fill_recursive()
 
@@ -809,23 +850,49 @@ def layout_room(room: Room) -> None:
     room.layout_children(rect)
 
 
+def redraw_window() -> None:
+    """
+    Makes the next frame update the whole window. Needed after drawing on display.window outside of draw_room.
+    """
+    global _redraw_window
+    _redraw_window = True
+
+
 def draw_room(room: Room, first_draw=False):
     """
-    Draws the root Room.
+    Draws the root Room and updates the parts of the window that changed.
     :param room: the room to draw.
     :param first_draw: True if it's the first frame.
     """
-    if room.clear_screen:
-        display.window.fill(room.clear_screen)
+    global _redraw_window, _overlays
     if not room.layout.valid:
         layout_room(room)
+        _redraw_window = True
     if first_draw:
         room.fill_recursive()
+        _redraw_window = True
     if not room.valid:
         room.draw()
-    display.window.blit(room.surface, room.rect)
-    display.draw_fps()
-    display.flip()
+    if _redraw_window or room.dirty is None:
+        rects = [display.get_rect()]
+        if room.clear_screen:
+            display.window.fill(room.clear_screen)
+        display.window.blit(room.surface, room.rect)
+        repaint = rects
+    else:
+        rects = [area.move(room.rect.topleft) for area in room.dirty]
+        repaint = rects + _overlays
+        for rect in repaint:
+            if room.clear_screen:
+                display.window.fill(room.clear_screen, rect)
+            rect = rect.clip(room.rect)
+            display.window.blit(room.surface, rect, rect.move(-room.rect.x, -room.rect.y))
+    room.dirty = []
+    _redraw_window = False
+    _overlays = display.draw_fps()
+    if display.show_redraws:
+        _overlays += display.draw_redraws(rects, sum(r.w * r.h for r in repaint + _overlays))
+    display.update(repaint + _overlays)
 
 
 def generic_event_handler(_events: List[pygame.event.Event]) -> None:
@@ -872,6 +939,7 @@ def run_room(room: Room) -> None:
     if room.allowed_events:
         events.set_allowed(allowed_events)
     room.root = False
+    redraw_window()  # the room that ran before this one, if any, must cover it again
 
 
 def run(first_room):
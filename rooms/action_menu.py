@@ -5,6 +5,7 @@ import gui
 import map
 import unit
 
+from forecast import forecast
 from fonts import SMALL
 
 from gettext import gettext as _
@@ -144,8 +145,11 @@ class ActionMenu(gui.Menu):
     def begin(self):
         self.parent: map.Map
         super().begin()
+        attack_label = _("Attack")
+        if self.attacking and self.defending:
+            attack_label += " (%s)" % forecast(self.attacking, self.defending)
         #NEW
-        self.menu_entries = ([(_("Attack"), lambda *_: self.menu_attack())] if len(self.parent.nearby_enemies()) > 0 else []) + [
+        self.menu_entries = ([(attack_label, lambda *_: self.menu_attack())] if len(self.parent.nearby_enemies()) > 0 else []) + [
             (_("Items"), lambda *_: self.menu_items()),
             (_("Wait"), lambda *_: self.menu_wait())
         ] + ([(_("Entangle"), lambda *_: self.menu_entangle())] if not unit.Unit.isEntangled else [])
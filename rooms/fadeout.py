@@ -28,7 +28,7 @@ class Fadeout(room.Room):
         self.fade.set_alpha(alpha)
         self.clock += dt
         self.done = self.clock >= self.duration
-        self.valid = False
+        self.invalidate()
 
     def draw(self):
         self.surface.fill(c.BLACK)
@@ -8,6 +8,7 @@ import gui
 import resources
 import colors as c
 import fonts as f
+import preloader
 import state as s
 
 from room import Gravity, Layout, LayoutParams
@@ -33,6 +34,7 @@ class MapMenu(gui.LinearLayout):
 
     def chosen(self, menu, choice):
         map_path = resources.map_path(choice)
+        preloader.cancel()  # whatever is left won't be needed before this map is loaded
         try:
             s.load_map(map_path)
         except:
@@ -0,0 +1,41 @@
+import pygame.locals as p
+
+import gui
+import room
+import display
+import fonts as f
+import colors as c
+import state as s
+
+
+class MeasurementWait(gui.Label):
+    """
+    Shown when a collapse needs a measurement whose job is still running. It keeps redrawing the map underneath at
+    full frame rate and ends as soon as the executor posts the MEASURED event for its Quantum.
+    """
+    def __init__(self, event: 'quantum.Quantum', **kwargs):
+        import quantum
+        super().__init__(_("Waiting for measurement"), f.MAIN, txt_color=c.ICE, wait=False, clear_screen=None,
+                         layout=room.Layout(gravity=room.Gravity.CENTER), padding=10,
+                         allowed_events=[quantum.MEASURED, p.VIDEORESIZE], **kwargs)
+        self.event = event
+        self.register(quantum.MEASURED, self.handle_measured)
+
+    def begin(self):
+        super().begin()
+        self.done = self.event.ready()
+
+    def handle_measured(self, event):
+        if event.quantum is self.event:
+            self.done = True
+
+    def loop(self, _events, dt):
+        super().loop(_events, dt)
+        # the job could have finished while the event was blocked by another room
+        self.done = self.done or self.event.ready()
+        _map = s.loaded_map
+        if _map is not None and _map.rect.size != (0, 0):
+            if not _map.valid:
+                _map.draw()
+            display.window.blit(_map.surface, _map.global_rect())
+            room.redraw_window()
@@ -7,6 +7,7 @@ import pygame
 from pygame.locals import MOUSEBUTTONDOWN, KEYDOWN
 
 import gui
+import preloader
 import resources
 
 from fonts import MAIN_MENU
@@ -19,6 +20,7 @@ class SplashScreen(gui.Label):
     def __init__(self):
         super().__init__("iQuHack\n" + _("PRESENTS"), MAIN_MENU, background=Background(color=BLACK),
                          allowed_events=[MOUSEBUTTONDOWN, KEYDOWN])
+        self.percent = -1  # loading progress shown, None once it is over
 
     def begin(self):
         super().begin()
@@ -26,6 +28,18 @@ class SplashScreen(gui.Label):
         self.set_timeout(6000, self.handle_timeout)
         self.next = MainMenu()
 
+    def loop(self, _events, dt):
+        super().loop(_events, dt)
+        loading = preloader.get()
+        if loading is not None:
+            percent = None if loading.finished else int(loading.progress * 100)
+            if percent != self.percent:  # the label is rendered again only when the number changes
+                self.percent = percent
+                if percent is None:
+                    self.set_text(self.format_string)
+                else:
+                    self.set_text(self.format_string + "\n\n" + _("Loading %d%%") % percent)
+
     def handle_timeout(self, event):
         self.done = True
 
@@ -1,7 +1,20 @@
+"""
+Sound effects, decoded on demand.
+
+At import the sounds directory is only indexed: every sound is a file (hit.ogg) or a directory of variants played at
+random (wood/). Audio is decoded the first time a sound is played, or ahead of time by warm_up, and the decoded
+sounds are kept in a least recently used cache of CAPACITY bytes.
+"""
+
 import pygame
 import resources
 import logging
 import random
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List
 
 
 if not pygame.mixer.get_init():
@@ -10,7 +23,14 @@ if not pygame.mixer.get_init():
 
 __logger = logging.getLogger('Sounds')
 extensions = ['.ogg', '.wav']
-sounds = {}
+CAPACITY = 16 * 1024 * 1024  #: bytes of decoded sounds to keep
+WARM_UP = ['cursor', 'hit', 'miss', 'critical', 'null', 'exp']  #: sounds decoded by the preloader
+
+index: Dict[str, List[Path]] = {}  # sound name -> its variants, a single file for plain sounds
+volumes: Dict[Path, float] = {}
+_cache = OrderedDict()  # Path -> pygame.mixer.Sound
+_lock = threading.Lock()  # the preloader decodes on its own thread
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
 
 
 def parse_cfg(fpath):
@@ -20,43 +40,89 @@ def parse_cfg(fpath):
             for line in f:
                 k, v = line.split('=')
                 if k == 'volume' and 0 <= float(v) <= 1.0:
-                    sounds[fpath.stem].set_volume(float(v))
+                    volumes[fpath.with_suffix('')] = float(v)
     except FileNotFoundError:
         pass
 
 
 for f in resources.list_sounds():
     if f.is_file() and f.suffix in extensions:
-        sounds[f.stem] = pygame.mixer.Sound(str(f))
+        index[f.stem] = [f]
         parse_cfg(f.with_suffix('.cfg'))
     elif f.is_dir():
-        sounds[f.name] = []
-        for fd in f.iterdir():
-            if fd.suffix in extensions:
-                sounds[f.name].append(pygame.mixer.Sound(str(fd)))
-                parse_cfg(fd.with_suffix('.cfg'))
+        index[f.name] = [fd for fd in sorted(f.iterdir()) if fd.suffix in extensions]
+        for fd in index[f.name]:
+            parse_cfg(fd.with_suffix('.cfg'))
+
+__logger.debug("Sounds indexed!")
+
+
+def sound_bytes(sound: pygame.mixer.Sound) -> int:
+    frequency, size, channels = pygame.mixer.get_init()
+    return int(sound.get_length() * frequency) * abs(size) // 8 * channels
+
+
+def load(path: Path) -> pygame.mixer.Sound:
+    """
+    Returns the decoded sound of path, decoding it if it isn't cached.
+    """
+    with _lock:
+        sound = _cache.get(path)
+        if sound is not None:
+            _stats['hits'] += 1
+            _cache.move_to_end(path)
+            return sound
+    sound = pygame.mixer.Sound(str(path))
+    volume = volumes.get(path.with_suffix(''))
+    if volume is not None:
+        sound.set_volume(volume)
+    with _lock:
+        _stats['misses'] += 1
+        if path in _cache:
+            return _cache[path]  # decoded on another thread meanwhile
+        _cache[path] = sound
+        _stats['bytes'] += sound_bytes(sound)
+        for old in list(_cache):
+            if _stats['bytes'] <= CAPACITY:
+                break
+            if old != path and _cache[old].get_num_channels() == 0:  # stopping it would cut it short
+                _stats['bytes'] -= sound_bytes(_cache.pop(old))
+                _stats['evictions'] += 1
+    return sound
+
+
+def warm_up(sounds: Iterable[str] = WARM_UP) -> None:
+    """
+    Decodes every variant of sounds, so that they are ready the first time they are played.
+    """
+    for sound in sounds:
+        for path in index.get(sound, []):
+            load(path)
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats, sounds=len(_cache))
 
-__logger.debug("Sounds initialized!")
 
 def play(sound, *args):
     try:
-        sounds[sound].play(*args)
-    except AttributeError:
-        random.choice(sounds[sound]).play(*args)
+        get(sound).play(*args)
     except KeyError:
         __logger.error("Could not play sound %s: file not found.", sound)
 
 def stop(sound):
     try:
-        sounds[sound].stop()
-    except AttributeError:
-        for s in sounds[sound]:
-            s.stop()
+        variants = index[sound]
     except KeyError:
         __logger.error("Could not stop sound %s.", sound)
+        return
+    for path in variants:
+        s = _cache.get(path)
+        if s is not None:  # a sound that isn't decoded isn't playing
+            s.stop()
 
 def get(sound):
-    if isinstance(sounds[sound], pygame.mixer.Sound):
-        return sounds[sound]
-    return random.choice(sounds[sound])
-
+    variants = index[sound]
+    if not variants:
+        raise KeyError(sound)
+    return load(random.choice(variants))
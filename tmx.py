@@ -39,7 +39,15 @@ import pygame
 import os.path
 import zlib
 import gzip
+import threading
+import hashlib
+import json
+import mmap
 
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pygame import Rect
 from xml.etree import ElementTree
 from base64 import b64decode
@@ -47,14 +55,40 @@ from base64 import b64decode
 from basictypes import Point
 
 
+_executor = None
+
+
+def get_executor():
+    '''The thread tiles are scaled on in the background.
+    '''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tmx')
+    return _executor
+
+
+_images = {}  # tileset image file -> decoded Surface, see decode_image
+
+
+def decode_image(file):
+    '''Return the image file decoded but not converted, which only the main
+    thread can do. Images are decoded once and kept, as the same tilesets
+    are used by many maps.
+    '''
+    image = _images.get(file)
+    if image is None:
+        image = _images.setdefault(file, pygame.image.load(file))
+    return image
+
+
 class Tile(object):
     def __init__(self, gid, surface, tileset):
         self.gid = gid
-        self.surface = self.scaled = surface
+        self.surface = surface
+        self.tileset = tileset
         self.tile_width = tileset.tile_width
         self.tile_height = tileset.tile_height
         self.properties = {}
-        self.zoom = 1
 
     @classmethod
     def fromSurface(cls, surface):
@@ -63,9 +97,10 @@ class Tile(object):
         Its tile_width and tile_height will be set using the Surface dimensions.
         Its gid will be 0.
         '''
-        class ts:
-            tile_width, tile_height = surface.get_size()
-        return cls(0, surface, ts)
+        tileset = Tileset(None, *surface.get_size(), 0)
+        tile = cls(0, surface, tileset)
+        tileset.tiles.append(tile)
+        return tile
 
     def loadxml(self, tag):
         props = tag.find('properties')
@@ -84,11 +119,10 @@ class Tile(object):
     def __repr__(self):
         return '<Tile %d>' % self.gid
 
-    def set_zoom(self, zoom):
-        if zoom != self.zoom:
-            size = self.tile_width * zoom, self.tile_height * zoom
-            self.scaled = pygame.transform.scale(self.surface, size)
-            self.zoom = zoom
+    def get_scaled(self, zoom):
+        '''Return this tile scaled by zoom, see Tileset.get_scaled.
+        '''
+        return self.tileset.get_scaled(self, zoom)
 
 
 class Tileset(object):
@@ -99,6 +133,8 @@ class Tileset(object):
         self.firstgid = firstgid
         self.tiles = []
         self.properties = {}
+        self.scaled = {}  # (gid, zoom) -> Surface
+        self.lock = threading.Lock()
 
     @classmethod
     def fromxml(cls, tag, pwd, firstgid=None):
@@ -127,8 +163,17 @@ class Tileset(object):
                 tileset.get_tile(gid).loadxml(c)
         return tileset
 
+    @classmethod
+    def image_files(cls, tag, pwd):
+        '''Return the image files used by the tileset described by tag.
+        '''
+        if 'source' in tag.attrib:
+            with open(os.path.join(pwd, tag.attrib['source'])) as f:
+                return cls.image_files(ElementTree.fromstring(f.read()), pwd)
+        return [os.path.join(pwd, c.attrib['source']) for c in tag.iter() if c.tag == 'image']
+
     def add_image(self, file):
-        image = pygame.image.load(file).convert_alpha()
+        image = decode_image(file).convert_alpha()
         if not image:
             sys.exit("Error creating new Tileset: file %s not found" % file)
         id = self.firstgid
@@ -142,6 +187,20 @@ class Tileset(object):
     def get_tile(self, gid):
         return self.tiles[gid - self.firstgid]
 
+    def get_scaled(self, tile, zoom):
+        '''Return tile scaled by zoom. Every tile is scaled once per zoom
+        level and shared by all the cells using it.
+        '''
+        key = (tile.gid, zoom)
+        scaled = self.scaled.get(key)
+        if scaled is None:
+            with self.lock:  # the tile may be being scaled in the background
+                scaled = self.scaled.get(key)
+                if scaled is None:
+                    size = self.tile_width * zoom, self.tile_height * zoom
+                    scaled = self.scaled[key] = pygame.transform.scale(tile.surface, size)
+        return scaled
+
 
 class Tilesets(dict):
     def add(self, tileset):
@@ -167,43 +226,77 @@ class Cell(object):
     You may assign a new value for a property to or even delete an existing
     property from the cell - this will not affect the Tile or any other Cells
     using the Cell's Tile.
+
+    Layers don't store Cells, only gids: a Cell is a view created when it is
+    looked up, which the Layer keeps only once its properties are changed.
     '''
-    def __init__(self, x, y, px, py, tile):
+    __slots__ = ('x', 'y', 'px', 'py', 'tile', 'layer', '_added_properties', '_deleted_properties')
+
+    def __init__(self, x, y, px, py, tile, layer=None):
         self.x, self.y = x, y
         self.px, self.py = px, py
         self.tile = tile
-        self.topleft = (px, py)
-        self.left = px
-        self.right = px + tile.tile_width
-        self.top = py
-        self.bottom = py + tile.tile_height
-        self.center = (px + tile.tile_width // 2, py + tile.tile_height // 2)
-        self._added_properties = {}
-        self._deleted_properties = set()
+        self.layer = layer
+        self._added_properties = None
+        self._deleted_properties = None
+
+    @property
+    def topleft(self):
+        return self.px, self.py
+
+    @property
+    def left(self):
+        return self.px
+
+    @property
+    def right(self):
+        return self.px + self.tile.tile_width
+
+    @property
+    def top(self):
+        return self.py
+
+    @property
+    def bottom(self):
+        return self.py + self.tile.tile_height
+
+    @property
+    def center(self):
+        return self.px + self.tile.tile_width // 2, self.py + self.tile.tile_height // 2
 
     def __repr__(self):
         return '<Cell %s,%s %d>' % (self.px, self.py, self.tile.gid)
 
     def __contains__(self, key):
-        if key in self._deleted_properties:
+        if self._deleted_properties and key in self._deleted_properties:
             return False
-        return key in self._added_properties or key in self.tile.properties
+        return bool(self._added_properties and key in self._added_properties) or key in self.tile.properties
 
     def __getitem__(self, key):
-        if key in self._deleted_properties:
+        if self._deleted_properties and key in self._deleted_properties:
             raise KeyError(key)
-        if key in self._added_properties:
+        if self._added_properties and key in self._added_properties:
             return self._added_properties[key]
         if key in self.tile.properties:
             return self.tile.properties[key]
         raise KeyError(key)
 
     def __setitem__(self, key, value):
+        self.__keep()
         self._added_properties[key] = value
 
     def __delitem__(self, key):
+        self.__keep()
         self._deleted_properties.add(key)
 
+    def __keep(self):
+        # from now on this cell differs from its tile: the layer must hand out this very view
+        if self._added_properties is None:
+            self._added_properties = {}
+            self._deleted_properties = set()
+            if self.layer is not None:
+                self.layer.cells[self.x, self.y] = self
+
     def intersects(self, other):
         '''Determine whether this Cell intersects with the other rect (which has
         .x, .y, .width and .height attributes.)
@@ -220,23 +313,19 @@ class Cell(object):
 
 
 class LayerIterator(object):
-    '''Iterates over all the cells in a layer in column,row order.
+    '''Iterates over all the cells in a layer in row order, skipping the
+    empty ones with a single scan of the gids.
     '''
     def __init__(self, layer):
         self.layer = layer
-        self.i, self.j = 0, 0
+        self.indexes = iter(np.flatnonzero(layer.gids > 0).tolist())
+
+    def __iter__(self):
+        return self
 
     def __next__(self):
-        if self.i == self.layer.width:
-            self.j += 1
-            self.i = 0
-        if self.j == self.layer.height:
-            raise StopIteration()
-        value = self.layer[self.i, self.j]
-        self.i += 1
-        if value is None:
-            return self.__next__()
-        return value
+        j, i = divmod(next(self.indexes), self.layer.width)
+        return self.layer[i, j]
 
 
 class Layer(object):
@@ -249,12 +338,14 @@ class Layer(object):
         px_width, px_height - the dimensions of the Layer in pixels
         tilesets - the tilesets used in this Layer (a Tilesets instance)
         properties - any properties set for this Layer
-        cells - a dict of all the Cell instances for this Layer, keyed off
-                (x, y) index.
+        gids - the gid of every cell in row order, 0 where there is none, as
+               a flat numpy int32 array
+        cells - the Cells whose properties were changed, keyed off (x, y)
+                index; the other ones are created when they are looked up
 
     Additionally you may look up a cell using direct item access:
 
-       layer[x, y] is layer.cells[x, y]
+       layer[x, y]
 
     Note that empty cells will be set to None instead of a Cell instance.
     '''
@@ -271,19 +362,49 @@ class Layer(object):
         self.tilesets = map.tilesets
         self.group = pygame.sprite.Group()
         self.properties = {}
+        self.gids = np.zeros(self.width * self.height, dtype='<i4')
         self.cells = {}
+        self.version = 0  # incremented whenever a cell changes, see TileChunks
 
     def __repr__(self):
         return '<Layer "%s" at 0x%x>' % (self.name, id(self))
 
     def __getitem__(self, pos):
-        return self.cells.get(pos)
+        cell = self.cells.get(pos)
+        if cell is not None:
+            return cell
+        tile = self.tile_at(*pos)
+        if tile is None:
+            return None
+        x, y = pos
+        return Cell(x, y, x * self.tile_width, y * self.tile_height, tile, self)
 
     def __setitem__(self, pos, tile):
         x, y = pos
-        px = x * self.tile_width
-        py = y * self.tile_width
-        self.cells[pos] = Cell(x, y, px, py, tile)
+        if not self.gids.flags.writeable:
+            self.gids = self.gids.copy()  # it was decoded straight from the TMX data
+        self.gids[y * self.width + x] = tile.gid
+        self.cells[pos] = Cell(x, y, x * self.tile_width, y * self.tile_height, tile, self)
+        self.version += 1
+
+    def tile_at(self, x, y):
+        '''Return the Tile of the cell at index (x, y), or None.
+        '''
+        cell = self.cells.get((x, y))
+        if cell is not None:
+            return cell.tile
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        gid = int(self.gids[y * self.width + x])
+        return self.tilesets[gid] if gid > 0 else None
+
+    def tiles(self):
+        '''Return the set of the Tiles used by this layer.
+        '''
+        gids = np.unique(self.gids)
+        tiles = {self.tilesets[gid] for gid in gids[gids > 0].tolist()}
+        tiles.update(cell.tile for cell in self.cells.values())
+        return tiles
 
     def __iter__(self):
         return LayerIterator(self)
@@ -291,11 +412,15 @@ class Layer(object):
     @classmethod
     def fromxml(cls, tag, map):
         offset = (int(tag.attrib.get('offsetx', 0)), int(tag.attrib.get('offsety', 0)))
-        layer = cls(tag.attrib['name'], int(tag.attrib.get('visible', 1)), offset, map)
+        return cls.fromgids(tag.attrib['name'], int(tag.attrib.get('visible', 1)), offset, cls.decode(tag), map)
 
+    @staticmethod
+    def decode(tag):
+        '''Return the gids of a <layer> tag as a numpy int32 array.
+        '''
         data_tag = tag.find('data')
         if data_tag is None:
-            raise ValueError('layer %s does not contain <data>' % layer.name)
+            raise ValueError('layer %s does not contain <data>' % tag.attrib['name'])
 
         data = data_tag.text.strip()
         data = data.encode() # Convert to bytes
@@ -305,15 +430,15 @@ class Layer(object):
             data = gzip.decompress(data)
         elif data_tag.attrib["compression"] == "zlib":
             data = zlib.decompress(data)
-        data = struct.unpack('<%di' % (len(data)/4,), data)
-        assert len(data) == layer.width * layer.height
-        for i, gid in enumerate(data):
-            if gid < 1: continue   # not set
-            tile = map.tilesets[gid]
-            x = i % layer.width
-            y = i // layer.width
-            layer.cells[x,y] = Cell(x, y, x*map.tile_width, y*map.tile_height, tile)
+        return np.frombuffer(data, dtype='<i4')  # TMX data is little endian
 
+    @classmethod
+    def fromgids(cls, name, visible, offset, data, map):
+        '''Create a Layer from its gids, in row order (0 is empty).
+        '''
+        layer = cls(name, visible, offset, map)
+        assert len(data) == layer.width * layer.height
+        layer.gids = np.asarray(data, dtype='<i4')
         return layer
 
     def update(self, dt, *args):
@@ -324,8 +449,6 @@ class Layer(object):
         self.view_w, self.view_h = w, h
         self.position = (x, y)
         self.zoom = zoom
-        for cell in self:
-            cell.tile.set_zoom(zoom)
 
     def draw(self, surface):
         '''Draw this layer, limited to the current viewport, to the Surface.
@@ -337,18 +460,28 @@ class Layer(object):
             i = x // tw
             for y in range(oy, oy + h + th, th):
                 j = y // th
-                if (i, j) not in self.cells:
-                    continue
-                cell = self.cells[i, j]
-                surface.blit(cell.tile.scaled, (cell.px * self.zoom - ox, cell.py * self.zoom - oy))
+                tile = self.tile_at(i, j)
+                if tile is not None:
+                    surface.blit(tile.get_scaled(self.zoom), (i * tw - ox, j * th - oy))
+
+    def scan(self, test):
+        '''Return the cells, in row order, for which test(cell) is true.
+        test is called once per distinct tile, on any cell using it, and once
+        per cell whose properties were changed.
+        '''
+        gids = np.unique(self.gids)
+        passing = [gid for gid in gids[gids > 0].tolist() if test(Cell(0, 0, 0, 0, self.tilesets[gid]))]
+        mask = np.isin(self.gids, passing).reshape(self.height, self.width)
+        for (x, y), cell in self.cells.items():
+            mask[y, x] = test(cell)
+        rows, columns = np.nonzero(mask)
+        return [self[x, y] for y, x in zip(rows.tolist(), columns.tolist())]
 
     def find(self, *properties):
         '''Find all cells with the given properties set.'''
         r = []
         for propname in properties:
-            for cell in list(self.cells.values()):
-                if cell and propname in cell:
-                    r.append(cell)
+            r.extend(self.scan(lambda cell: propname in cell))
         return r
 
     def match(self, **properties):
@@ -356,11 +489,8 @@ class Layer(object):
         '''
         r = []
         for propname in properties:
-            for cell in list(self.cells.values()):
-                if propname not in cell:
-                    continue
-                if properties[propname] == cell[propname]:
-                    r.append(cell)
+            value = properties[propname]
+            r.extend(self.scan(lambda cell: propname in cell and cell[propname] == value))
         return r
 
     def collide(self, rect, propname):
@@ -383,14 +513,13 @@ class Layer(object):
 
         Return a list of Cell instances.
         '''
-        i1 = max(0, x1 // self.tile_width)
-        j1 = max(0, y1 // self.tile_height)
-        i2 = min(self.width, x2 // self.tile_width + 1)
-        j2 = min(self.height, y2 // self.tile_height + 1)
-        return [self.cells[i, j]
-            for i in range(int(i1), int(i2))
-                for j in range(int(j1), int(j2))
-                    if (i, j) in self.cells]
+        i1 = int(max(0, x1 // self.tile_width))
+        j1 = int(max(0, y1 // self.tile_height))
+        i2 = int(max(i1, min(self.width, x2 // self.tile_width + 1)))
+        j2 = int(max(j1, min(self.height, y2 // self.tile_height + 1)))
+        region = self.gids.reshape(self.height, self.width)[j1:j2, i1:i2]
+        columns, rows = np.nonzero(region.T > 0)
+        return [self[i1 + i, j1 + j] for i, j in zip(columns.tolist(), rows.tolist())]
 
     def get_at(self, x, y):
         '''Return the cell at the nominated (x, y) coordinate.
@@ -399,7 +528,7 @@ class Layer(object):
         '''
         i = x // self.tile_width
         j = y // self.tile_height
-        return self.cells.get((i, j))
+        return self[i, j]
 
     def neighbors(self, index):
         '''Return the indexes of the valid (ie. within the map) cardinal (ie.
@@ -667,6 +796,7 @@ class SpriteLayer(pygame.sprite.AbstractGroup):
     def __init__(self):
         super().__init__()
         self.visible = True
+        self.seen = {}  # sprite -> (rect, image) at the last call of changed
 
     def set_view(self, x, y, w, h, zoom):
         self.view_x, self.view_y = x, y
@@ -684,6 +814,36 @@ class SpriteLayer(pygame.sprite.AbstractGroup):
                                 int(sprite.rect.height)))
             screen.blit(sprite.image, (sx - ox, sy - oy), area)
 
+    def changed(self):
+        '''Return the screen rects touched since the last call by the sprites
+        that were added, removed, moved or given a new image.
+
+        Sprites that draw on their image in place must set their dirty
+        attribute (as pygame.sprite.DirtySprite does) and may list in
+        dirty_rects the parts of their rect that changed.
+        '''
+        ox, oy = self.position
+        rects = []
+        seen = {}
+        for sprite in self.sprites():
+            rect, image = sprite.rect, sprite.image
+            seen[sprite] = (Rect(rect), image)
+            old = self.seen.pop(sprite, None)
+            if old is None:
+                rects.append(rect)
+            elif old[0] != rect or old[1] is not image:
+                rects.append(rect)
+                rects.append(old[0])
+            elif getattr(sprite, 'dirty', 0):
+                rects.extend(getattr(sprite, 'dirty_rects', None) or [rect])
+            if getattr(sprite, 'dirty', 0):
+                sprite.dirty = 0
+                if getattr(sprite, 'dirty_rects', None):
+                    sprite.dirty_rects = []
+        rects.extend(rect for rect, _ in self.seen.values())  # removed
+        self.seen = seen
+        return [rect.move(-ox, -oy) for rect in rects]
+
 
 class Layers(list):
     def __init__(self):
@@ -699,6 +859,96 @@ class Layers(list):
         return self.by_name[item]
 
 
+class TileChunks(object):
+    '''The tile Layers of a TileMap pre-rendered, with the grid on top, in
+    square chunks of about size pixels.
+
+    Chunks are rendered the first time they are needed at a zoom level and
+    kept in a LRU cache of capacity chunks, so drawing a frame only takes a
+    handful of blits whatever the zoom and the size of the map. The cache is
+    cleared when a Layer changes (see Layer.version) or is shown or hidden.
+    '''
+    def __init__(self, tilemap, size=512, capacity=64):
+        self.tilemap = tilemap
+        self.size = size
+        self.capacity = capacity
+        self.chunks = OrderedDict()  # (zoom, chunk x, chunk y) -> Surface
+        self.layers_key = None
+        self.hits = 0
+        self.misses = 0
+
+    def chunk_tiles(self, zoom):
+        '''Return how many tiles a chunk is wide and high at zoom.
+        '''
+        tm = self.tilemap
+        return (max(1, self.size // (tm.tile_width * zoom)),
+                max(1, self.size // (tm.tile_height * zoom)))
+
+    def check_layers(self):
+        layers = [layer for layer in self.tilemap.layers if isinstance(layer, Layer)]
+        key = tuple((id(layer), layer.version, layer.visible) for layer in layers)
+        if key != self.layers_key:
+            self.layers_key = key
+            self.chunks.clear()
+        return [layer for layer in layers if layer.visible]
+
+    def get(self, zoom, cx, cy, layers):
+        key = (zoom, cx, cy)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.hits += 1
+            self.chunks.move_to_end(key)
+            return chunk
+        self.misses += 1
+        chunk = self.chunks[key] = self.render(zoom, cx, cy, layers)
+        if len(self.chunks) > self.capacity:
+            self.chunks.popitem(last=False)
+        return chunk
+
+    def render(self, zoom, cx, cy, layers):
+        tm = self.tilemap
+        tw, th = tm.tile_width * zoom, tm.tile_height * zoom
+        nx, ny = self.chunk_tiles(zoom)
+        x0, y0 = cx * nx, cy * ny
+        x1, y1 = min(tm.width, x0 + nx), min(tm.height, y0 + ny)
+        w, h = (x1 - x0) * tw, (y1 - y0) * th
+        chunk = pygame.Surface((w, h), pygame.SRCALPHA)
+        for layer in layers:
+            tilesets = layer.tilesets
+            block = layer.gids.reshape(tm.height, tm.width)[y0:y1, x0:x1].tolist()
+            for j, row in enumerate(block):
+                for i, gid in enumerate(row):
+                    if gid > 0:
+                        chunk.blit(tilesets[gid].get_scaled(zoom), (i * tw, j * th))
+
+        # the grid: a 2 pixel line across every border between two tiles
+        vertical_line = pygame.Surface((2, h))
+        vertical_line.set_alpha(100)
+        horizontal_line = pygame.Surface((w, 2))
+        horizontal_line.set_alpha(100)
+        for i in range(max(1, x0), min(tm.width - 1, x1) + 1):
+            chunk.blit(vertical_line, ((i - x0) * tw - 1, 0))
+        for j in range(max(1, y0), min(tm.height - 1, y1) + 1):
+            chunk.blit(horizontal_line, (0, (j - y0) * th - 1))
+        return chunk
+
+    def draw(self, surface):
+        '''Draw the chunks intersecting the viewport of the TileMap.
+        '''
+        layers = self.check_layers()
+        if not layers:
+            return
+        tm = self.tilemap
+        zoom = tm.zoom
+        ox, oy = tm.viewport.topleft
+        w, h = tm.view_w, tm.view_h
+        nx, ny = self.chunk_tiles(zoom)
+        cw, ch = nx * tm.tile_width * zoom, ny * tm.tile_height * zoom
+        for cy in range(max(0, oy // ch), min((tm.height - 1) // ny, (oy + h) // ch) + 1):
+            for cx in range(max(0, ox // cw), min((tm.width - 1) // nx, (ox + w) // cw) + 1):
+                surface.blit(self.get(zoom, cx, cy, layers), (cx * cw - ox, cy * ch - oy))
+
+
 class TileMap(object):
     '''A TileMap is a collection of Layers which contain gridded maps or sprites
     which are drawn constrained by a viewport.
@@ -743,12 +993,45 @@ class TileMap(object):
         self.view_x, self.view_y = origin   # viewport offset
         self.viewport = Rect(origin, size)
         self.zoom = 1
+        self.chunks = TileChunks(self)
+        self.view_key = None  # what the whole viewport looked like at the last call of changed
+        self.tiles_key = None
+        self.tiles = set()
         self.set_focus(self.view_w // 2, self.view_h // 2)
 
     def set_zoom(self, zoom, fx, fy):
         self.zoom = zoom
+        self.scale_tiles(zoom)
+        for neighbour in (zoom - 1, zoom + 1):
+            if neighbour >= 1:
+                self.scale_tiles(neighbour, background=True)
         self.set_focus(fx, fy)
 
+    def used_tiles(self):
+        '''Return the set of the Tiles used by the Layers, collected again
+        only when a Layer changes.
+        '''
+        layers = [layer for layer in self.layers if isinstance(layer, Layer)]
+        key = tuple((id(layer), layer.version) for layer in layers)
+        if key != self.tiles_key:
+            self.tiles_key = key
+            self.tiles = set().union(*(layer.tiles() for layer in layers))
+        return self.tiles
+
+    def scale_tiles(self, zoom, background=False):
+        '''Scale the tiles in use to zoom now, or on the tile scaling thread
+        if background, so that zooming costs one scale per tile, not per cell.
+        '''
+        tiles = list(self.used_tiles())
+
+        def scale():
+            for tile in tiles:
+                tile.get_scaled(zoom)
+
+        if background:
+            return get_executor().submit(scale)
+        scale()
+
     def __getattr__(self, attr):
         if attr.startswith('zoom'):
             real_attr = attr.split('_', 1)[1]
@@ -761,43 +1044,120 @@ class TileMap(object):
             layer.update(dt, *args)
 
     def draw(self, screen):
+        # tile layers and grid come pre-rendered, under everything else
+        self.chunks.draw(screen)
         for layer in self.layers:
-            if layer.visible:
+            if layer.visible and not isinstance(layer, Layer):
                 layer.draw(screen)
-        horizontal_line = pygame.Surface((self.zoom_px_width, 2))
-        horizontal_line.set_alpha(100)
-        vertical_line = pygame.Surface((2, self.zoom_px_height))
-        vertical_line.set_alpha(100)
-        for i in range(1, self.width):
-             screen.blit(vertical_line, (-self.childs_ox + i * self.zoom_tile_width - 1, -self.childs_oy))
-        for j in range(1, self.height):
-             screen.blit(horizontal_line, (-self.childs_ox, -self.childs_oy + j * self.zoom_tile_height - 1))
+
+    def changed(self):
+        '''Return the screen rects that changed since the last call, or None
+        if the whole viewport did: it scrolled, the zoom changed or a layer
+        was edited, shown or hidden.
+        '''
+        rects = []
+        for layer in self.layers:
+            if isinstance(layer, SpriteLayer) and layer.visible:
+                rects.extend(layer.changed())
+        key = (tuple(self.viewport), self.zoom,
+               tuple((id(layer), layer.visible, getattr(layer, 'version', 0)) for layer in self.layers))
+        if key != self.view_key:
+            self.view_key = key
+            return None
+        return rects
 
     @classmethod
-    def load(cls, filename, viewport, origin=(0, 0)):
+    def load(cls, filename, viewport, origin=(0, 0), cache_dir=None):
+        '''Load a TMX file. With a cache_dir the map is compiled there on the
+        first load (see CompiledMap) and read back from it afterwards, as
+        long as the TMX file doesn't change.
+        '''
+        pwd = os.path.dirname(filename)
+        return cls.build(*cls.compile(filename, cache_dir), pwd, viewport, origin)
+
+    @classmethod
+    def compile(cls, filename, cache_dir=None):
+        '''Return what parse returns for filename, reading it from the
+        compiled version in cache_dir when it is fresh and compiling it
+        there otherwise. Doesn't need the display: safe on any thread.
+        '''
+        if cache_dir is None:
+            return cls.parse(filename)
+
+        path = CompiledMap.path(filename, cache_dir)
+        try:
+            with CompiledMap.open(path) as compiled:
+                if compiled.is_fresh(filename):
+                    return compiled.header, compiled.layers()
+        except (OSError, ValueError, KeyError):
+            pass  # not compiled yet, or by another version
+        header, layers = cls.parse(filename)
+        try:
+            CompiledMap.write(path, filename, header, layers)
+        except OSError:
+            pass  # read only cache, the map is loaded all the same
+        return header, layers
+
+    @staticmethod
+    def parse(filename):
+        '''Parse a TMX file into a header (a dict with everything but the
+        tiles, tilesets and object groups kept as XML) and the gid arrays of
+        its layers.
+        '''
         with open(filename) as f:
             map = ElementTree.fromstring(f.read())
 
+        properties = {}
+        props = map.find('properties')
+        if props is not None:
+            for c in props.findall('property'):
+                properties[c.attrib['name']] = c.attrib['value']
+
+        header = {
+            'width': int(map.attrib['width']),
+            'height': int(map.attrib['height']),
+            'tilewidth': int(map.attrib['tilewidth']),
+            'tileheight': int(map.attrib['tileheight']),
+            'properties': properties,
+            'tilesets': [ElementTree.tostring(tag, encoding='unicode') for tag in map.findall('tileset')],
+            'layers': [],
+            'objectgroups': [ElementTree.tostring(tag, encoding='unicode') for tag in map.findall('objectgroup')],
+        }
+        layers = []
+        for tag in map.findall('layer'):
+            header['layers'].append({
+                'name': tag.attrib['name'],
+                'visible': int(tag.attrib.get('visible', 1)),
+                'offset': (int(tag.attrib.get('offsetx', 0)), int(tag.attrib.get('offsety', 0))),
+            })
+            layers.append(Layer.decode(tag))
+        return header, layers
+
+    @classmethod
+    def build(cls, header, layers, pwd, viewport, origin=(0, 0)):
+        '''Create a TileMap from what parse returns.
+        '''
         # get most general map informations and create a surface
         tilemap = TileMap(viewport, origin)
-        tilemap.width = int(map.attrib['width'])
-        tilemap.height  = int(map.attrib['height'])
-        tilemap.tile_width = int(map.attrib['tilewidth'])
-        tilemap.tile_height = int(map.attrib['tileheight'])
+        tilemap.width = header['width']
+        tilemap.height = header['height']
+        tilemap.tile_width = header['tilewidth']
+        tilemap.tile_height = header['tileheight']
         tilemap.tile_size = Point((tilemap.tile_width, tilemap.tile_height))
         tilemap.px_width = tilemap.width * tilemap.tile_width
         tilemap.px_height = tilemap.height * tilemap.tile_height
         tilemap.px_size = Point((tilemap.px_width, tilemap.px_height))
+        tilemap.properties = dict(header['properties'])
 
-        for tag in map.findall('tileset'):
-            tilemap.tilesets.add(Tileset.fromxml(tag, os.path.dirname(filename)))
+        for xml in header['tilesets']:
+            tilemap.tilesets.add(Tileset.fromxml(ElementTree.fromstring(xml), pwd))
 
-        for tag in map.findall('layer'):
-            layer = Layer.fromxml(tag, tilemap)
+        for attrib, gids in zip(header['layers'], layers):
+            layer = Layer.fromgids(attrib['name'], attrib['visible'], tuple(attrib['offset']), gids, tilemap)
             tilemap.layers.add_named(layer, layer.name)
 
-        for tag in map.findall('objectgroup'):
-            layer = ObjectLayer.fromxml(tag, tilemap)
+        for xml in header['objectgroups']:
+            layer = ObjectLayer.fromxml(ElementTree.fromstring(xml), tilemap)
             tilemap.layers.add_named(layer, layer.name)
 
         return tilemap
@@ -930,8 +1290,121 @@ class TileMap(object):
             return self.pixel_to_screen(sx, sy)
         return Point((sx, sy))
 
-def load(filename, viewport, origin=(0, 0)):
-    return TileMap.load(filename, viewport, origin)
+class CompiledMap(object):
+    '''A TMX map compiled to a binary file, so that loading it again takes
+    neither XML parsing nor base64 decoding and decompression:
+
+        'TMXC', header length (uint32), JSON header, padding to 4 bytes,
+        the gids of every layer as little endian int32 arrays
+
+    The header is what TileMap.parse returns, plus the size, mtime and
+    SHA-1 of the TMX file it was compiled from and where each layer's gids
+    start. The file is mmap'ed and the gids are copied out of it in one go,
+    so that it can be closed as soon as the map is built: use it as a
+    context manager, or call close.
+    '''
+    MAGIC = b'TMXC'
+    VERSION = 1
+
+    def __init__(self, header, buffer):
+        self.header = header
+        self.buffer = buffer
+
+    @staticmethod
+    def path(filename, cache_dir):
+        '''Return where the compiled version of filename is kept in cache_dir.
+        '''
+        filename = os.path.abspath(filename)
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        return os.path.join(cache_dir, '%s-%s.tmxc' % (stem, hashlib.sha1(filename.encode()).hexdigest()[:12]))
+
+    @staticmethod
+    def digest(filename):
+        with open(filename, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if buffer[:4] != cls.MAGIC:
+                raise ValueError('%s is not a compiled map' % path)
+            length, = struct.unpack_from('<I', buffer, 4)
+            header = json.loads(bytes(buffer[8:8 + length]))
+            if header.get('format') != cls.VERSION:
+                raise ValueError('%s was compiled by another version' % path)
+        except Exception:
+            buffer.close()
+            raise
+        return cls(header, buffer)
+
+    def close(self):
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_fresh(self, filename):
+        '''Return whether filename is still the TMX file this was compiled from.
+        '''
+        stat = os.stat(filename)
+        if stat.st_size != self.header['size']:
+            return False
+        return stat.st_mtime_ns == self.header['mtime'] or self.digest(filename) == self.header['sha1']
+
+    def layers(self):
+        '''Return copies of the gids of every layer, that outlive the file.
+        '''
+        count = self.header['width'] * self.header['height']
+        return [np.frombuffer(self.buffer, dtype='<i4', count=count, offset=attrib['gids']).copy()
+                for attrib in self.header['layers']]
+
+    @classmethod
+    def write(cls, path, filename, header, layers):
+        '''Compile the map parsed from filename into path.
+        '''
+        stat = os.stat(filename)
+        header = dict(header, format=cls.VERSION, size=stat.st_size, mtime=stat.st_mtime_ns,
+                      sha1=cls.digest(filename), layers=[dict(attrib) for attrib in header['layers']])
+        # the gids offsets depend on the header length, which depends on the offsets: reserve room for them
+        for attrib in header['layers']:
+            attrib['gids'] = 2 ** 31
+        first = 8 + len(json.dumps(header).encode())
+        first += -first % 4
+        start = first
+        for attrib, gids in zip(header['layers'], layers):
+            attrib['gids'] = start
+            start += len(gids) * 4
+        data = json.dumps(header).encode()
+        data += b' ' * (first - 8 - len(data))  # padding that JSON ignores
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(temporary, 'wb') as f:
+            f.write(cls.MAGIC + struct.pack('<I', len(data)) + data)
+            for gids in layers:
+                f.write(np.asarray(gids, dtype='<i4').tobytes())
+        os.replace(temporary, path)
+
+
+def load(filename, viewport, origin=(0, 0), cache_dir=None):
+    return TileMap.load(filename, viewport, origin, cache_dir)
+
+
+def preload(filename, cache_dir=None):
+    '''Do the part of load that doesn't need the display ahead of time:
+    compile the map into cache_dir and decode its tileset images (see
+    decode_image). Safe to call from any thread.
+    '''
+    header, _ = TileMap.compile(filename, cache_dir)
+    pwd = os.path.dirname(filename)
+    for xml in header['tilesets']:
+        for file in Tileset.image_files(ElementTree.fromstring(xml), pwd):
+            decode_image(file)
 
 if __name__ == '__main__':
     pygame.init()
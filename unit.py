@@ -22,19 +22,22 @@
 import pygame
 import random
 import logging
-from quantum import Quantum
+import sys
 
 import utils
 import resources
 import string
 
-from typing import Tuple, List, Dict, Optional
+from typing import Tuple, List, Dict, Optional, TYPE_CHECKING
 from gettext import gettext as _
 from abc import ABC, abstractmethod
 
 #NEW
 import state as s
 
+if TYPE_CHECKING:
+    from quantum import Quantum
+
 Coord = Tuple[int, int]
 
 
@@ -173,7 +176,6 @@ class Unit(object):
     """
     This class is a unit with stats
     """
-    entangled_image = None
     isEntangled = False
 
     ALLOWED_TERRAINS = ['earth']
@@ -207,16 +209,14 @@ class Unit(object):
         self.modified     = True
 
         #NEW
-        self.entangled: Quantum    = None # what other ally the unit is entangled with
+        self.entangled: 'Quantum'  = None # what other ally the unit is entangled with
 
 
         try:
-            self.trueImage = resources.load_sprite(self.name).convert_alpha()
-            new_size = utils.resize_keep_ratio(self.trueImage.get_size(), (200, 200))
-            self.trueImage = pygame.transform.smoothscale(self.trueImage, new_size)
+            self.trueImage = resources.get_sprite(self.name, (200, 200))
         except FileNotFoundError:
-            logging.warning("Couldn't load %s! Loading default image", resources.sprite_path(self.trueImage))
-            self.trueImage = resources.load_sprite('no_image.png').convert_alpha()
+            logging.warning("Couldn't load %s! Loading default image", resources.sprite_path(self.name))
+            self.trueImage = resources.get_sprite('no_image.png')
         self.image = self.trueImage
 
     def __repr__(self):
@@ -275,12 +275,14 @@ class Unit(object):
             return active_weapon.min_range, active_weapon.max_range
         return 1, 1
 
-    def number_of_attacks(self, enemy: 'Unit') -> Tuple[int, int]:
+    def number_of_attacks(self, enemy: 'Unit', distance: Optional[int] = None) -> Tuple[int, int]:
         """
         Returns a tuple: how many times this unit can attack the enemy
         and how many times the enemy can attack this unit in a single battle
+        :param distance: distance the battle takes place at (defaults to the current distance between the units)
         """
-        distance = utils.distance(self.coord, enemy.coord)
+        if distance is None:
+            distance = utils.distance(self.coord, enemy.coord)
         self_attacks = enemy_attacks = 1
 
         if self.speed > enemy.speed:
@@ -300,18 +302,29 @@ class Unit(object):
     def life_percent(self) -> int:
         return int(float(self.health) / float(self.health_max) * 100.0)
 
-    def attack(self, enemy: 'Unit') -> Tuple[str, int]:
-        if self.weapon is None or self.weapon.uses == 0:
-            print(_("%s attacks %s with his bare hands") % (self.name, enemy.name))
+    def attack_stats(self, enemy: 'Unit', weapon=None) -> Tuple[float, int, int]:
+        """
+        Returns hit probability, damage and critical probability (both probabilities in percent) of an attack
+        against enemy with weapon, or with bare hands if weapon is None.
+        """
+        if weapon is None:
             hit_probability = self.skill * 2 + self.luck / 2
             dmg = self.strength - enemy.defence
             critical_probability = self.skill // 2 - enemy.luck
         else:
-            print(_("%s attacks %s with %s") % (self.name, enemy.name, self.weapon.name))
-            hit_probability = (self.skill * 2) + self.weapon.hit + (self.luck / 2)
-            dmg = (self.strength + self.weapon.might) - enemy.defence
+            hit_probability = (self.skill * 2) + weapon.hit + (self.luck / 2)
+            dmg = (self.strength + weapon.might) - enemy.defence
             # TODO add damage modifiers like HealthCondition, ElementalAffinity
-            critical_probability = self.skill // 2 + self.weapon.crit - enemy.luck
+            critical_probability = self.skill // 2 + weapon.crit - enemy.luck
+        return hit_probability, dmg, critical_probability
+
+    def attack(self, enemy: 'Unit') -> Tuple[str, int]:
+        if self.weapon is None or self.weapon.uses == 0:
+            print(_("%s attacks %s with his bare hands") % (self.name, enemy.name))
+            hit_probability, dmg, critical_probability = self.attack_stats(enemy)
+        else:
+            print(_("%s attacks %s with %s") % (self.name, enemy.name, self.weapon.name))
+            hit_probability, dmg, critical_probability = self.attack_stats(enemy, self.weapon)
 
         print("Dmg: %d  Hit: %d" % (dmg, hit_probability))
         hit = random.randrange(0, 100) < hit_probability
@@ -341,13 +354,11 @@ class Unit(object):
     def entangle(self, event) -> None:
         self.entangled = event
 
-        try: #todo: move this to a static variable of some sort
-            self.image = resources.load_sprite("Entangled").convert_alpha()
-            new_size = utils.resize_keep_ratio(self.image.get_size(), (200, 200))
-            self.image = pygame.transform.smoothscale(self.image, new_size)
+        try:
+            self.image = resources.get_sprite("Entangled", (200, 200))
         except FileNotFoundError:
             logging.warning("ENTANGLEMENT SPRITE ERROR: Couldn't load %s! Loading default image", resources.sprite_path("Entangled"))
-            self.image = resources.load_sprite('no_image.png').convert_alpha()
+            self.image = resources.get_sprite('no_image.png')
         self.modified = True
         Unit.isEntangled = True
         s.loaded_map.sprites_layer.update()
@@ -582,6 +593,9 @@ class UnitsManager(object):
 
     def switch_turn(self) -> Team:
         self.active_team.end_turn()
+        quantum = sys.modules.get('quantum')
+        if quantum is not None:  # nothing can be pending if nobody entangled yet
+            quantum.batch.flush()
         active_team_index = (self.teams.index(self.active_team) + 1) % len(self.teams)
         self.active_team = self.teams[active_team_index]
         self.active_team.begin_turn()
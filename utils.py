@@ -21,6 +21,8 @@
 #  MA 02110-1301, USA.
 
 
+import copy
+import os
 import pygame
 import sys
 import yaml
@@ -40,14 +42,26 @@ def timeit(f):
 
     return timed
 
+_yaml = {}  # path -> (mtime, parsed data), see load_yaml
+
+def load_yaml(path):
+    """
+    Returns the parsed content of a YAML file, parsing it only if it changed since the last time. The data is shared:
+    copy it before changing it.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    cached = _yaml.get(str(path))
+    if cached is None or cached[0] != mtime:
+        with open(path, 'r') as f:
+            cached = _yaml[str(path)] = (mtime, yaml.safe_load(f))
+    return cached[1]
+
 def parse_yaml(path, module):
     objects = {}
-    with open(path, 'r') as f:
-        data = yaml.safe_load(f)
-        for u in data:
-            u_class = module.__dict__[list(u.keys())[0]]
-            kwargs = list(u.values())[0]
-            objects[kwargs['name']] = u_class(**kwargs)
+    for u in copy.deepcopy(load_yaml(path)):
+        u_class = module.__dict__[list(u.keys())[0]]
+        kwargs = list(u.values())[0]
+        objects[kwargs['name']] = u_class(**kwargs)
     return objects
 
 def distance(p0, p1):
@@ -69,7 +83,29 @@ def center(rect1, rect2, xoffset=0, yoffset=0):
     """Center rect2 in rect1 with offset."""
     return (rect1.centerx - rect2.centerx + xoffset, rect1.centery - rect2.centery + yoffset)
 
+def merge_rects(rects):
+    """Merge rects of the same row that touch into strips, then strips of the same columns that touch into blocks.
+    Duplicates are dropped. Handy to turn many tiles into a few dirty rects."""
+    merged = []
+    for rect in sorted(set(map(tuple, rects)), key=lambda r: (r[1], r[3], r[0])):
+        x, y, w, h = rect
+        if merged and merged[-1][1] == y and merged[-1][3] == h and x <= merged[-1][0] + merged[-1][2]:
+            last = merged[-1]
+            last[2] = max(last[2], x + w - last[0])
+        else:
+            merged.append([x, y, w, h])
+    blocks = []
+    for x, y, w, h in sorted(merged, key=lambda r: (r[0], r[2], r[1])):
+        if blocks and blocks[-1][0] == x and blocks[-1][2] == w and y <= blocks[-1][1] + blocks[-1][3]:
+            last = blocks[-1]
+            last[3] = max(last[3], y + h - last[1])
+        else:
+            blocks.append([x, y, w, h])
+    return [pygame.Rect(block) for block in blocks]
+
 def return_to_os(*args):
+    import preloader  # it imports utils
+    preloader.shutdown()
     pygame.quit()
     sys.exit(0)
 